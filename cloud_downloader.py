@@ -13,6 +13,9 @@ import os
 from urllib.parse import urlparse, parse_qs
 import time
 import json
+from kemono_network import (http_get, http_head, get_part_path, load_part_state,
+                            build_resume_headers, start_part_write, clear_part_state,
+                            open_part_file, finish_part, count_received)
 
 class CloudDownloader:
     def __init__(self):
@@ -72,7 +75,7 @@ class CloudDownloader:
         # Сначала получаем информацию о файле
         info_url = f"https://drive.google.com/file/d/{file_id}/view"
         try:
-            response = self.session.get(info_url)
+            response = http_get(info_url, session=self.session)
             if response.status_code != 200:
                 print(f"❌ Ошибка получения информации: {response.status_code}")
                 return False
@@ -129,7 +132,7 @@ class CloudDownloader:
             
             try:
                 # Делаем HEAD запрос для получения заголовков
-                head_response = self.session.head(direct_url, timeout=10)
+                head_response = http_head(direct_url, session=self.session, timeout=10)
                 
                 if head_response.status_code == 200:
                     # Пытаемся извлечь имя файла из заголовка Content-Disposition
@@ -168,7 +171,7 @@ class CloudDownloader:
         
         try:
             # Получаем страницу файла
-            response = self.session.get(url)
+            response = http_get(url, session=self.session)
             if response.status_code != 200:
                 print(f"❌ Ошибка получения страницы: {response.status_code}")
                 return False
@@ -304,22 +307,29 @@ class CloudDownloader:
     
     def _download_file(self, url, save_dir, filename, handle_redirects=False):
         """
-        Универсальная функция для скачивания файла
+        Универсальная функция для скачивания файла (с докачкой .part через HTTP Range)
         """
         try:
             os.makedirs(save_dir, exist_ok=True)
             file_path = os.path.join(save_dir, filename)
+            part_path = get_part_path(file_path)
+            
+            # Если файл уже частично скачан - продолжаем с того же места
+            offset, meta = load_part_state(part_path)
+            headers = build_resume_headers(None, offset, meta)
             
             print(f"⬇️ Скачиваем: {filename}")
+            if offset:
+                print(f"⏩ Докачка с {offset} байт")
             
             # Специальная обработка для Google Drive редиректов
             if handle_redirects:
-                response = self.session.get(url, stream=True, allow_redirects=False)
+                response = http_get(url, stream=True, allow_redirects=False, headers=headers, session=self.session)
                 
                 # Обработка больших файлов Google Drive (virus scan warning)
                 if response.status_code == 302 or 'Location' in response.headers:
                     redirect_url = response.headers.get('Location', url)
-                    response = self.session.get(redirect_url, stream=True)
+                    response = http_get(redirect_url, stream=True, headers=headers, session=self.session)
                 elif 'virus scan warning' in response.text.lower():
                     # Ищем ссылку подтверждения
                     confirm_match = re.search(r'/uc\?export=download&amp;confirm=([^&]+)&amp;id=([^"]+)', response.text)
@@ -327,29 +337,44 @@ class CloudDownloader:
                         confirm_code = confirm_match.group(1)
                         file_id = confirm_match.group(2) 
                         confirm_url = f"https://drive.google.com/uc?export=download&confirm={confirm_code}&id={file_id}"
-                        response = self.session.get(confirm_url, stream=True)
+                        response = http_get(confirm_url, stream=True, headers=headers, session=self.session)
                         
             else:
-                response = self.session.get(url, stream=True)
+                response = http_get(url, stream=True, headers=headers, session=self.session)
             
-            if response.status_code != 200:
+            mode, offset, total_size = start_part_write(response, part_path, offset, meta)
+            
+            if mode == 'restart':
+                # Файл на сервере изменился или Range не поддерживается - качаем заново
+                print("⚠️ Сервер не поддержал докачку, скачиваем заново")
+                response.close()
+                clear_part_state(part_path, remove_part=True)
+                response = http_get(response.url, stream=True, session=self.session)
+                mode, offset, total_size = start_part_write(response, part_path, 0, {})
+            
+            if mode is None:
                 print(f"❌ Ошибка скачивания: HTTP {response.status_code}")
                 return False
             
-            # Получаем размер файла если доступен
-            total_size = int(response.headers.get('Content-Length', 0))
+            downloaded = offset
+            if mode != 'complete':
+                with open_part_file(part_path, mode, offset, total_size) as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            count_received(len(chunk))
+                            
+                            # Простой прогресс-бар
+                            if total_size:
+                                progress = (downloaded / total_size) * 100
+                                print(f"\r📥 Прогресс: {progress:.1f}% ({downloaded}/{total_size} байт)", end='')
             
-            with open(file_path, 'wb') as f:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Простой прогресс-бар
-                        if total_size > 0:
-                            progress = (downloaded / total_size) * 100
-                            print(f"\r📥 Прогресс: {progress:.1f}% ({downloaded}/{total_size} байт)", end='')
+            if total_size and downloaded < total_size:
+                print(f"\n⚠️ Файл скачан не полностью ({downloaded}/{total_size} байт), докачка при следующем запуске")
+                return False
+            
+            finish_part(part_path, file_path)
             
             print(f"\n✅ Файл скачан: {filename} ({downloaded} байт)")
             return True
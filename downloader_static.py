@@ -1,15 +1,27 @@
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import os
 import json
 import urllib3
+import requests
 import re
 import urllib.parse
 import hashlib
 import time
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor, as_completed,
+                                wait, FIRST_COMPLETED)
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import threading
+import queue
+from collections import deque, namedtuple
+from kemono_network import (http_get, http_head, MAX_SEGMENTS_PER_FILE,
+                            get_part_path, open_resumable, clear_part_state,
+                            open_part_file, load_part_state, save_part_state,
+                            parse_content_range, mirror_manager, preallocate,
+                            finish_part, sync_batcher, PART_WRITE_BUFFER, network_stats, count_received)
+from kemono_state import ProgressDatabase
+from kemono_blobs import BlobStore, hash_file, file_sha256, url_sha256, hashed_filepath
 
 # Попытка импорта CloudDownloader для автоскачивания облачных файлов
 try:
@@ -21,6 +33,13 @@ except ImportError:
     CLOUD_AUTO_ENABLED = False
     print("⚠️ cloud_downloader.py не найден - автоскачивание облачных файлов отключено")
 
+# Быстрый парсер lxml для HTML fallback (встроенный html.parser - если lxml не установлен)
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
 # Отключаем предупреждения SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -36,6 +55,14 @@ HEADERS = {
     "Connection": "keep-alive"
 }
 
+# Заголовки для загрузки HTML страниц (резервный парсинг)
+HTML_HEADERS = {
+    "User-Agent": STATIC_USER_AGENT,
+    "Referer": "https://kemono.cr/",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+
 # Список всех поддерживаемых расширений файлов
 SUPPORTED_EXTENSIONS = {
     # 3D модели и файлы Blender
@@ -67,62 +94,68 @@ def is_supported_file(filename):
     ext = os.path.splitext(filename.lower())[1]
     return ext in SUPPORTED_EXTENSIONS or len(filename) > 3  # Поддерживаем все файлы с именем
 
+# Паттерны для различных облачных сервисов (хост после https://)
+CLOUD_SERVICE_PATTERNS = {
+    'Google Drive': [r'drive\.google\.com/', r'docs\.google\.com/'],
+    'MEGA': [r'mega\.nz/', r'mega\.co\.nz/'],
+    'Dropbox': [r'(?:www\.)?dropbox\.com/', r'dl\.dropboxusercontent\.com/'],
+    'OneDrive': [r'onedrive\.live\.com/', r'1drv\.ms/'],
+    'MediaFire': [r'(?:www\.)?mediafire\.com/'],
+    'WeTransfer': [r'(?:we\.tl|wetransfer\.com)/'],
+    'pCloud': [r'(?:my\.)?pcloud\.com/'],
+    'Yandex Disk': [r'disk\.yandex\.[^\s<>"/]+/'],
+    'Box': [r'(?:app\.)?box\.com/'],
+    'iCloud': [r'(?:www\.)?icloud\.com/'],
+}
+
+# Все сервисы одним выражением: группа cloud0, cloud1... соответствует сервису
+CLOUD_SERVICE_NAMES = list(CLOUD_SERVICE_PATTERNS)
+CLOUD_LINK_RE = re.compile(
+    r'https://(?:' + '|'.join(
+        f"(?P<cloud{index}>{'|'.join(CLOUD_SERVICE_PATTERNS[name])})"
+        for index, name in enumerate(CLOUD_SERVICE_NAMES)
+    ) + r')[^\s<>"]+',
+    re.IGNORECASE)
+
+def normalize_cloud_url(url):
+    """Ключ для сравнения облачных ссылок: без регистра хоста, www. и / в конце"""
+    scheme, _, rest = url.partition('://')
+    host, slash, path = rest.partition('/')
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return f"{host}{slash}{path}".rstrip('/')
+
 def detect_cloud_links(content):
-    """Обнаруживает ссылки на облачные сервисы в контенте"""
+    """
+    Обнаруживает ссылки на облачные сервисы в контенте (текст API или HTML,
+    str или сырые bytes страницы) за один проход по всем сервисам
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    
     cloud_links = []
+    seen_urls = set()
     
-    # Паттерны для различных облачных сервисов
-    cloud_patterns = {
-        'Google Drive': [
-            r'https://drive\.google\.com/[^\s<>"]+',
-            r'https://docs\.google\.com/[^\s<>"]+',
-        ],
-        'MEGA': [
-            r'https://mega\.nz/[^\s<>"]+',
-            r'https://mega\.co\.nz/[^\s<>"]+',
-        ],
-        'Dropbox': [
-            r'https://(?:www\.)?dropbox\.com/[^\s<>"]+',
-            r'https://dl\.dropboxusercontent\.com/[^\s<>"]+',
-        ],
-        'OneDrive': [
-            r'https://onedrive\.live\.com/[^\s<>"]+',
-            r'https://1drv\.ms/[^\s<>"]+',
-        ],
-        'MediaFire': [
-            r'https://(?:www\.)?mediafire\.com/[^\s<>"]+',
-        ],
-        'WeTransfer': [
-            r'https://(?:we\.tl|wetransfer\.com)/[^\s<>"]+',
-        ],
-        'pCloud': [
-            r'https://(?:my\.)?pcloud\.com/[^\s<>"]+',
-        ],
-        'Yandex Disk': [
-            r'https://disk\.yandex\.[^\s<>"/]+/[^\s<>"]+',
-        ],
-        'Box': [
-            r'https://(?:app\.)?box\.com/[^\s<>"]+',
-        ],
-        'iCloud': [
-            r'https://(?:www\.)?icloud\.com/[^\s<>"]+',
-        ]
-    }
-    
-    for service_name, patterns in cloud_patterns.items():
-        for pattern in patterns:
-            matches = re.findall(pattern, content, re.IGNORECASE)
-            for match in matches:
-                # Очищаем ссылку от лишних символов
-                clean_link = match.rstrip('.,;:)"}')
-                if clean_link not in [link['url'] for link in cloud_links]:
-                    cloud_links.append({
-                        'service': service_name,
-                        'url': clean_link
-                    })
+    for match in CLOUD_LINK_RE.finditer(content):
+        # Очищаем ссылку от лишних символов
+        clean_link = match.group(0).replace('&amp;', '&').rstrip('.,;:)"}')
+        key = normalize_cloud_url(clean_link)
+        if key in seen_urls:
+            continue
+        seen_urls.add(key)
+        
+        service_index = int(match.lastgroup[len('cloud'):])
+        cloud_links.append({
+            'service': CLOUD_SERVICE_NAMES[service_index],
+            'url': clean_link
+        })
     
     return cloud_links
 
+# Посты разбираются параллельно - запись в cloud_links.txt по одному
+_cloud_links_lock = threading.Lock()
+
 def save_cloud_links(save_dir, cloud_links, post_url):
     """Сохраняет найденные облачные ссылки в файл"""
     if not cloud_links:
@@ -132,6 +165,13 @@ def save_cloud_links(save_dir, cloud_links, post_url):
     os.makedirs(save_dir, exist_ok=True)
     cloud_file = os.path.join(save_dir, 'cloud_links.txt')
     
+    with _cloud_links_lock:
+        _save_cloud_links_locked(cloud_file, cloud_links, post_url)
+    
+    if _progress_db:
+        _progress_db.add_cloud_links(save_dir, cloud_links, post_url)
+
+def _save_cloud_links_locked(cloud_file, cloud_links, post_url):
     try:
         # Читаем существующие ссылки если файл есть
         existing_links = set()
@@ -204,9 +244,8 @@ def download_cloud_files(save_dir, cloud_links, post_url):
                 print(f"❌ Не удалось скачать {service} файл")
         except Exception as e:
             print(f"❌ Ошибка скачивания {service}: {e}")
-        
-        # Минимальная пауза для стабильности
-        time.sleep(0.1)
+    
+    sync_batcher.flush()
     
     if downloaded_files:
         print(f"\n✅ Успешно скачано облачных файлов: {len(downloaded_files)}")
@@ -288,8 +327,189 @@ def convert_thumbnail_to_full(url):
     
     return url
 
-def get_creator_posts(creator_url):
-    """Получает все посты автора через API с пагинацией"""
+# Постов на одной странице листинга API и сколько страниц запрашиваем одновременно
+LISTING_PAGE_SIZE = 50
+LISTING_WORKERS = 4
+# Сколько уже обработанных постов подряд означает, что дальше в листинге только старые
+INCREMENTAL_KNOWN_RUN = 50
+# Раз в сколько дней листинг все равно проходится целиком - чтобы найти правки старых постов
+FULL_LISTING_MAX_AGE_DAYS = 7
+
+def get_incremental_known_posts(progress_data, full_rescan=False, max_age_days=FULL_LISTING_MAX_AGE_DAYS):
+    """
+    Обработанные посты для инкрементальной синхронизации (листинг идет от новых к старым).
+    None - нужен полный листинг: он запрошен явно, полного прохода по автору еще не было
+    или он был больше max_age_days дней назад (правки старых постов видны только в нем)
+    """
+    full_listing_at = progress_data.get('full_listing_at')
+    if full_rescan or not full_listing_at:
+        return None
+    try:
+        age = datetime.now() - datetime.fromisoformat(full_listing_at)
+    except (TypeError, ValueError):
+        return None
+    if age.days >= max_age_days:
+        print(f"🔄 Последний полный листинг был {age.days} дн. назад - проходим автора целиком")
+        return None
+    return _index_progress(progress_data)['completed_posts']
+
+def mark_full_listing(save_dir, progress_data, post_urls):
+    """
+    Отмечает, что автор пройден целиком, если все посты листинга обработаны.
+    Иначе инкрементальная синхронизация могла бы навсегда пропустить
+    старые посты с ошибками, оставшиеся за серией обработанных
+    """
+    completed_posts = _index_progress(progress_data)['completed_posts']
+    if all(hashlib.md5(post_url.encode()).hexdigest() in completed_posts for post_url in post_urls):
+        record_progress_value(save_dir, progress_data, 'full_listing_at', datetime.now().isoformat())
+
+def get_creator_post_count(service, creator_id):
+    """Количество постов из профиля автора (None, если профиль недоступен)"""
+    try:
+        url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}/profile"
+        response = http_get(url, headers=HEADERS, verify=False, timeout=15)
+        if response.status_code == 200:
+            post_count = response.json().get('post_count')
+            if isinstance(post_count, int) and post_count >= 0:
+                return post_count
+    except Exception as e:
+        print(f"  ⚠️ Не удалось получить профиль автора: {e}")
+    return None
+
+def fetch_listing_page(service, creator_id, offset):
+    """Одна страница листинга постов автора"""
+    url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}/posts?o={offset}"
+    response = http_get(url, headers=HEADERS, verify=False, timeout=30)
+    if response.status_code != 200:
+        raise Exception(f"Ошибка API: {response.status_code}")
+    data = response.json()
+    return data if isinstance(data, list) else []
+
+def paginate_creator_posts(service, creator_id, workers=LISTING_WORKERS,
+                           known_posts=None, known_run=INCREMENTAL_KNOWN_RUN, known_versions=None):
+    """
+    Загружает листинг постов автора, запрашивая несколько страниц одновременно.
+    Число страниц берется из post_count профиля; если его нет (или он устарел) -
+    страницы запрашиваются наперед, пока не придет короткая или пустая,
+    а лишние запросы за концом списка отменяются.
+    known_posts - ID обработанных постов (md5 URL): листинг останавливается
+    на known_run таких постах подряд, страницы наперед запрашиваются осторожно.
+    known_versions - сохраненные версии постов {ID: версия}: пост, версия которого
+    изменилась (правка), прерывает серию обработанных постов.
+    Возвращает (посты, листинг без ошибок, дошли до конца списка) - остановка
+    на серии обработанных постов не считается концом списка
+    """
+    limit = LISTING_PAGE_SIZE
+    known_versions = known_versions or {}
+    planned_pages = None
+    if not known_posts:
+        post_count = get_creator_post_count(service, creator_id)
+        if post_count is not None:
+            planned_pages = (post_count + limit - 1) // limit
+            print(f"📊 В профиле {post_count} постов - {planned_pages} страниц")
+    
+    # Инкрементально новых постов обычно меньше страницы - наперед
+    # начинаем с одной страницы и удваиваем, пока новые посты идут
+    lookahead = 1
+    known_streak = 0
+    complete = False
+    reached_end = False
+    
+    posts = []
+    results = {}  # номер страницы -> данные или исключение
+    in_flight = {}  # future -> номер страницы
+    next_page = 0  # Следующая страница для запроса
+    done_page = 0  # Все страницы до этой уже обработаны по порядку
+    finished = False
+    
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        while not finished:
+            # Страницы из профиля - по workers сразу, но не дальше последней из них;
+            # за пределы профиля (он мог устареть) - по одной и только после того,
+            # как последняя страница профиля разобрана и оказалась полной.
+            # Без профиля - наперед на workers страниц
+            page_limit = None
+            if known_posts:
+                window = lookahead
+            elif planned_pages is None:
+                window = workers
+            elif done_page < planned_pages:
+                window = workers
+                page_limit = planned_pages
+            else:
+                window = 1
+            while len(in_flight) < window and (page_limit is None or next_page < page_limit):
+                offset = next_page * limit
+                print(f"📄 Загружаем страницу {next_page + 1} (offset {offset})...")
+                in_flight[executor.submit(fetch_listing_page, service, creator_id, offset)] = next_page
+                next_page += 1
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    results[page] = future.result()
+                except Exception as e:
+                    results[page] = e
+            
+            # Разбираем готовые страницы строго по порядку
+            while done_page in results and not finished:
+                data = results.pop(done_page)
+                page_number = done_page + 1
+                done_page += 1
+                
+                if isinstance(data, Exception):
+                    # Повторы уже сделал http_get - дальше идти нельзя, но и молчать тоже
+                    print(f"  ❌ Ошибка запроса: {data}")
+                    print(f"  ⚠️ Список постов неполный: остановились на странице {page_number} (offset {(page_number - 1) * limit})")
+                    finished = True
+                    break
+                
+                if not data:
+                    print(f"  ✅ Достигнут конец списка постов")
+                    finished = complete = reached_end = True
+                    break
+                
+                # Сохраняем записи постов целиком (file/attachments нужны для быстрого поиска)
+                batch_posts = [post for post in data if isinstance(post, dict) and 'id' in post]
+                for post in batch_posts:
+                    post['post_url'] = f"https://kemono.cr/{service}/user/{creator_id}/post/{post['id']}"
+                    if known_posts:
+                        post_id = hashlib.md5(post['post_url'].encode()).hexdigest()
+                        stored_version = known_versions.get(post_id)
+                        unchanged = not stored_version or stored_version == get_post_version(post)
+                        if post_id in known_posts and unchanged:
+                            known_streak += 1
+                        else:
+                            known_streak = 0
+                posts.extend(batch_posts)
+                
+                print(f"  📊 Страница {page_number}: получено {len(batch_posts)} постов, всего: {len(posts)}")
+                
+                # Если получили меньше limit, значит это последняя страница
+                if len(data) < limit:
+                    print(f"  🏁 Последняя страница (получено {len(data)} < {limit})")
+                    finished = complete = reached_end = True
+                elif known_posts and known_streak >= known_run:
+                    print(f"  ⏹️ {known_streak} уже обработанных постов подряд - дальше только старые, листинг остановлен")
+                    finished = complete = True
+                else:
+                    lookahead = min(workers, lookahead * 2)
+        
+        # Запросы за концом списка больше не нужны
+        for future in in_flight:
+            future.cancel()
+    
+    return posts, complete, reached_end
+
+def get_creator_posts_data(creator_url, known_posts=None, status=None, known_versions=None):
+    """
+    Получает все посты автора через API с пагинацией (полные записи листинга).
+    Каждая запись содержит id, file, attachments и т.д. + ключ 'post_url'.
+    known_posts, known_versions - инкрементальный режим (см. paginate_creator_posts)
+    status - словарь, в который записываются 'complete' (листинг без ошибок)
+    и 'reached_end' (листинг дошел до конца списка постов)
+    """
     print("🔄 Извлекаем информацию из URL...")
     
     # Парсим URL для получения service и creator_id
@@ -306,63 +526,205 @@ def get_creator_posts(creator_url):
                     print(f"🎯 Service: {service}")
                     print(f"👤 Creator ID: {creator_id}")
                     
-                    posts = []
-                    offset = 0
-                    limit = 50
-                    
-                    page = 1
-                    while True:
-                        try:
-                            url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}/posts?o={offset}"
-                            print(f"📄 Загружаем страницу {page} (offset {offset})...")
-                            
-                            response = requests.get(url, headers=HEADERS, verify=False, timeout=30)
-                            
-                            if response.status_code != 200:
-                                print(f"  ❌ Ошибка API: {response.status_code}")
-                                break
-                            
-                            data = response.json()
-                            
-                            if not data or len(data) == 0:
-                                print(f"  ✅ Достигнут конец списка постов")
-                                break
-                            
-                            # Извлекаем ID постов
-                            batch_posts = [post['id'] for post in data if 'id' in post]
-                            posts.extend(batch_posts)
-                            
-                            print(f"  📊 Страница {page}: получено {len(batch_posts)} постов, всего: {len(posts)}")
-                            
-                            # Если получили меньше limit, значит это последняя страница
-                            if len(data) < limit:
-                                print(f"  🏁 Последняя страница (получено {len(data)} < {limit})")
-                                break
-                            
-                            offset += limit
-                            page += 1
-                            
-                            # Небольшая пауза между запросами для снижения нагрузки на сервер
-                            import time
-                            time.sleep(0.5)
-                            
-                        except Exception as e:
-                            print(f"  ❌ Ошибка запроса: {e}")
-                            break
+                    posts, complete, reached_end = paginate_creator_posts(
+                        service, creator_id, known_posts=known_posts, known_versions=known_versions)
+                    if status is not None:
+                        status['complete'] = complete
+                        status['reached_end'] = reached_end
                     
                     print(f"  ✅ Итого постов: {len(posts)}")
-                    
-                    # Возвращаем URL для каждого поста
-                    post_urls = []
-                    for post_id in posts:
-                        post_url = f"https://kemono.cr/{service}/user/{creator_id}/post/{post_id}"
-                        post_urls.append(post_url)
-                    
-                    return post_urls
+                    return posts
     
     print("❌ Неверный формат URL")
     return []
 
+def get_creator_posts(creator_url):
+    """Получает все посты автора через API с пагинацией"""
+    # Возвращаем URL для каждого поста
+    return [post['post_url'] for post in get_creator_posts_data(creator_url)]
+
+def is_direct_link_filename(filename):
+    """Проверяет, не является ли имя файла прямой ссылкой (MEGA, Google Drive и т.д.)"""
+    return isinstance(filename, str) and ('http' in filename or 'mega.nz' in filename or 'drive.google.com' in filename)
+
+def post_needs_enhanced_scan(post):
+    """
+    Определяет, нужен ли посту отдельный запрос /post/{id} для Enhanced поиска.
+    Листинг содержит только начало текста (substring), поэтому полный контент
+    запрашиваем для постов без файлов и для постов с ссылками в тексте.
+    """
+    if post.get('content'):
+        return False  # Полный контент уже есть в листинге
+    
+    if not post.get('file') and not post.get('attachments'):
+        return True  # Текстовый пост - ссылки могут быть только в контенте
+    
+    substring = (post.get('substring') or '').lower()
+    return any(hint in substring for hint in ('http', '<a', '<img', 'drive', 'mega', 'dropbox'))
+
+# Серверы CDN в ссылках на файлы поста (у превью свой server, по умолчанию n1)
+DEFAULT_FILE_SERVER = 'https://n3.kemono.cr'
+DEFAULT_PREVIEW_SERVER = 'https://n1.kemono.cr'
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.webm', '.gif')
+
+class PostAttachment:
+    """
+    Файл поста из ответа API: путь на CDN (/ce/15/ce152b1d...png), имя файла,
+    сервер, вид (file/attachment/preview/video) и секция ответа, где он найден
+    """
+    __slots__ = ('path', 'name', 'server', 'kind', 'section')
+    
+    def __init__(self, path, name, server, kind, section):
+        self.path = path
+        self.name = name
+        self.server = server
+        self.kind = kind
+        self.section = section
+    
+    @property
+    def url(self):
+        return f"{self.server}/data{self.path}?f={self.name}"
+    
+    @property
+    def file_type(self):
+        return get_file_type(self.name)
+    
+    @property
+    def is_video(self):
+        return self.name.lower().endswith(VIDEO_EXTENSIONS)
+    
+    def __repr__(self):
+        return f"PostAttachment({self.path!r}, {self.name!r}, {self.kind!r}, {self.section!r})"
+
+def normalize_post_attachments(data):
+    """
+    Собирает файлы поста за один проход по всем секциям ответа API
+    (post.file, file, post.attachments, attachments, previews, videos).
+    Подходит и для записи листинга (file, attachments).
+    Повторы отбрасываются по пути на CDN. Возвращает список PostAttachment
+    """
+    post_data = data.get('post') if isinstance(data.get('post'), dict) else {}
+    sections = [
+        ('post.file', post_data.get('file'), 'file'),
+        ('file', data.get('file'), 'file'),
+        ('post.attachments', post_data.get('attachments'), 'attachment'),
+        ('attachments', data.get('attachments'), 'attachment'),
+        ('previews', data.get('previews'), 'preview'),
+        ('videos', data.get('videos'), 'video'),
+    ]
+    
+    attachments = []
+    seen_paths = set()
+    
+    for section, items, kind in sections:
+        if isinstance(items, dict):
+            items = [items]
+        elif not isinstance(items, list):
+            continue
+        
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            path = item.get('path')
+            if not path or path in seen_paths:
+                continue
+            
+            name = item.get('name') or path.rsplit('/', 1)[-1]
+            if is_direct_link_filename(name):
+                print(f"    ⚠️ Пропускаем прямую ссылку в filename: {name[:60]}...")
+                continue
+            
+            # У превью свой сервер (или n1), остальные файлы - с n3 (зеркало выберет загрузчик)
+            server = DEFAULT_FILE_SERVER
+            if kind == 'preview':
+                server = item.get('server')
+                if not (isinstance(server, str) and server.startswith('http')):
+                    server = DEFAULT_PREVIEW_SERVER
+            
+            seen_paths.add(path)
+            attachments.append(PostAttachment(path, name, server.rstrip('/'), kind, section))
+    
+    return attachments
+
+def get_link_filename(link):
+    """Имя файла из ссылки (параметр ?f= или последняя часть пути)"""
+    if '?f=' in link:
+        return link.split('?f=')[-1]
+    return link.split('/')[-1].split('?')[0]
+
+def get_link_data_path(link):
+    """Путь файла на CDN (/ce/15/ce152b1d...png) из ссылки kemono или None"""
+    _, data_path, _ = mirror_manager.split_url(link)
+    return data_path[len('/data'):] if data_path else None
+
+def get_post_media_from_listing(post, enhanced_search=True, save_dir=None):
+    """
+    Быстрый поиск файлов поста по записи из листинга автора (без запроса /post/{id}).
+    Per-post API вызывается только если посту нужен Enhanced поиск по контенту.
+    """
+    post_url = post['post_url']
+    
+    if enhanced_search and post_needs_enhanced_scan(post):
+        print(f"  🔍 Пост требует Enhanced поиска, запрашиваем полный пост...")
+        return get_post_media(post_url, enhanced_search=True, save_dir=save_dir)
+    
+    print(f"  📄 Быстрый поиск по листингу: {post.get('title') or post_url}")
+    
+    # Основной файл и вложения из записи листинга, а если листинг содержит
+    # полный контент - и ссылки из него (локально, без запроса к API)
+    attachments, content_links, cloud_links, _ = run_parser(parse_post_data, post, enhanced_search)
+    for attachment in attachments:
+        print(f"    📎 {attachment.file_type}: {attachment.name}")
+    media_links = [attachment.url for attachment in attachments]
+    
+    if content_links:
+        add_content_links(media_links, attachments, get_content_link_urls(content_links))
+    
+    if cloud_links and CLOUD_AUTO_ENABLED:
+        print(f"  ☁️ Найдено облачных ссылок: {len(cloud_links)}")
+        save_cloud_links(save_dir or os.path.join(os.getcwd(), "downloads"), cloud_links, post_url)
+    
+    print(f"   🎯 Найдено {len(media_links)} файлов (листинг)")
+    return media_links
+
+def add_content_links(media_links, attachments, content_links):
+    """
+    Добавляет ссылки из контента к файлам поста. Ссылка на файл, который
+    уже есть среди вложений (тот же путь на CDN), повторно не добавляется
+    """
+    seen_links = set(media_links)
+    seen_paths = {attachment.path for attachment in attachments}
+    added = []
+    for link in content_links:
+        data_path = get_link_data_path(link)
+        if link in seen_links or (data_path and data_path in seen_paths):
+            continue
+        media_links.append(link)
+        seen_links.add(link)
+        if data_path:
+            seen_paths.add(data_path)
+        added.append(link)
+    return added
+
+def parse_post_data(data, scan_content=True):
+    """
+    Разбирает ответ API поста или запись листинга (dict или сырые bytes JSON)
+    без сети - поэтому может выполняться в пуле процессов (см. run_parser).
+    Возвращает (attachments, content_links, cloud_links, длина контента)
+    """
+    if isinstance(data, (bytes, str)):
+        data = json.loads(data)
+    
+    attachments = normalize_post_attachments(data)
+    
+    content = data.get('content') or ''
+    if not content and isinstance(data.get('post'), dict):
+        content = data['post'].get('content') or ''
+    if not scan_content or not content:
+        return attachments, [], [], len(content)
+    
+    return attachments, extract_content_links(content), detect_cloud_links(content), len(content)
+
 def get_post_media(post_url, enhanced_search=True, save_dir=None):
     """Universal поиск ВСЕХ файлов в посте через API"""
     print(f"  📄 Получаем ВСЕ файлы через API: {post_url}")
@@ -370,271 +732,86 @@ def get_post_media(post_url, enhanced_search=True, save_dir=None):
     # Извлекаем service, creator_id и post_id из URL
     try:
         parts = post_url.split('/')
-        if 'kemono.cr' in post_url and 'user' in parts and 'post' in parts:
-            service_idx = parts.index('kemono.cr') + 1
-            user_idx = parts.index('user')
-            post_idx = parts.index('post')
-            
-            service = parts[service_idx]
-            creator_id = parts[user_idx + 1]
-            post_id = parts[post_idx + 1]
-            
-            print(f"  📄 Получаем все файлы через API: {service}/{creator_id}/post/{post_id}")
-            
-            api_url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}/post/{post_id}"
-            response = requests.get(api_url, headers=HEADERS, verify=False, timeout=15)
-            
-            print(f"  📶 API Status: {response.status_code}")
-            
-            if response.status_code != 200:
-                return []
-            
-            data = response.json()
-            
-            print(f"  🔍 UNIVERSAL SEARCH - ищем ВСЕ типы файлов (3D, архивы, документы, медиа)")
-            
-            media_links = []
-            found_files = []  # Для подсчета типов файлов
-            
-            # Отслеживаем уже добавленные файлы по пути, чтобы избежать дубликатов
-            added_file_paths = set()
-            
-            # 1. Основной файл поста (в post.file)
-            post_data = data.get('post', {})
-            if 'file' in post_data and post_data['file']:
-                filename = post_data['file'].get('name', 'unknown')
-                file_path = post_data['file'].get('path', '')
-                
-                # Проверяем, не является ли filename прямой ссылкой
-                if isinstance(filename, str) and ('http' in filename or 'mega.nz' in filename or 'drive.google.com' in filename):
-                    print(f"    ⚠️ Пропускаем прямую ссылку в filename: {filename[:60]}...")
-                elif file_path and is_supported_file(filename):
-                    # Поддерживаем разные домены (n3, n4, etc.)
-                    file_url = f"https://n3.kemono.cr/data{file_path}?f={filename}"
-                    file_type = get_file_type(filename)
-                    print(f"    📁 Основной файл ({file_type}): {filename}")
-                    found_files.append(file_type)
-                    media_links.append(file_url)
-                    added_file_paths.add(file_path)
-            
-            # 1.1. Основной файл поста (прямо в data.file, если есть)
-            if 'file' in data and data['file']:
-                filename = data['file'].get('name', 'unknown')
-                file_path = data['file'].get('path', '')
-                
-                # Проверяем, не является ли filename прямой ссылкой
-                if isinstance(filename, str) and ('http' in filename or 'mega.nz' in filename or 'drive.google.com' in filename):
-                    print(f"    ⚠️ Пропускаем прямую ссылку в filename: {filename[:60]}...")
-                elif file_path and is_supported_file(filename) and file_path not in added_file_paths:
-                    file_url = f"https://n3.kemono.cr/data{file_path}?f={filename}"
-                    file_type = get_file_type(filename)
-                    print(f"    📁 Дополнительный файл ({file_type}): {filename}")
-                    found_files.append(file_type)
-                    media_links.append(file_url)
-                    added_file_paths.add(file_path)
-            
-            # 2. Вложения поста (в post.attachments) - УНИВЕРСАЛЬНЫЙ ПОИСК
-            if 'attachments' in post_data and post_data['attachments']:
-                print(f"  📎 Анализируем вложения в post: {len(post_data['attachments'])}")
-                for attachment in post_data['attachments']:
-                    filename = attachment.get('name', 'unknown')
-                    file_path = attachment.get('path', '')
-                    if file_path and filename != 'unknown' and file_path not in added_file_paths:
-                        file_url = f"https://n3.kemono.cr/data{file_path}?f={filename}"
-                        file_type = get_file_type(filename)
-                        
-                        # Проверяем все файлы, не только известные расширения
-                        if is_supported_file(filename) or '.' in filename:
-                            print(f"      📎 {file_type}: {filename}")
-                            found_files.append(file_type)
-                            media_links.append(file_url)
-                            added_file_paths.add(file_path)
-                        else:
-                            print(f"      ⚠️ Неизвестный тип: {filename}")
-            
-            # 2.1. Вложения поста (прямо в data.attachments) - УНИВЕРСАЛЬНЫЙ ПОИСК
-            if 'attachments' in data and data['attachments']:
-                print(f"  📎 Анализируем корневые вложения: {len(data['attachments'])}")
-                for attachment in data['attachments']:
-                    filename = attachment.get('name', 'unknown')
-                    file_path = attachment.get('path', '')
-                    if file_path and filename != 'unknown' and file_path not in added_file_paths:
-                        file_url = f"https://n3.kemono.cr/data{file_path}?f={filename}"
-                        file_type = get_file_type(filename)
-                        
-                        if (is_supported_file(filename) or '.' in filename):
-                            print(f"      📎 {file_type}: {filename}")
-                            found_files.append(file_type)
-                            media_links.append(file_url)
-                            added_file_paths.add(file_path)
-            
-            # 2.2. Превью файлы (data.previews) - УНИВЕРСАЛЬНЫЙ ПОИСК
-            if 'previews' in data and data['previews']:
-                print(f"  🖼️ Анализируем превью: {len(data['previews'])}")
-                for preview in data['previews']:
-                    if isinstance(preview, dict):
-                        filename = preview.get('name', 'unknown')
-                        file_path = preview.get('path', '')
-                        server = preview.get('server', 'https://n1.kemono.cr')
-                        
-                        # Проверяем, не является ли filename прямой ссылкой
-                        if isinstance(filename, str) and ('http' in filename or 'mega.nz' in filename or 'drive.google.com' in filename):
-                            print(f"      ⚠️ Пропускаем прямую ссылку в preview filename: {filename[:60]}...")
-                            continue
-                            
-                        if file_path and filename != 'unknown' and file_path not in added_file_paths:
-                            # Используем указанный сервер или n1 по умолчанию
-                            if server and server.startswith('http'):
-                                file_url = f"{server}/data{file_path}?f={filename}"
-                            else:
-                                file_url = f"https://n1.kemono.cr/data{file_path}?f={filename}"
-                            
-                            file_type = get_file_type(filename)
-                            if (is_supported_file(filename) or '.' in filename):
-                                print(f"      🖼️ {file_type}: {filename}")
-                                found_files.append(file_type)
-                                media_links.append(file_url)
-                                added_file_paths.add(file_path)
-            
-            # 3. Дополнительные вложения из других мест
-            for key in ['attachments', 'file']:
-                if key in data and isinstance(data[key], list):
-                    for item in data[key]:
-                        if isinstance(item, dict):
-                            filename = item.get('name', 'unknown')
-                            file_path = item.get('path', '')
-                            if file_path and file_path not in [link.split('?')[0].replace('https://n3.kemono.cr/data', '') for link in media_links]:
-                                file_url = f"https://n3.kemono.cr/data{file_path}?f={filename}"
-                                media_links.append(file_url)
-            
-            # 4. Корневые вложения
-            if isinstance(data, dict):
-                root_attachments = []
-                for key, value in data.items():
-                    if key == 'attachments' and isinstance(value, list):
-                        root_attachments.extend(value)
-                
-                if root_attachments:
-                    print(f"  📎 Найдено корневых вложений: {len(root_attachments)}")
-                    for attachment in root_attachments:
-                        if isinstance(attachment, dict):
-                            filename = attachment.get('name', 'unknown')
-                            print(f"      • {filename}")
-                        elif isinstance(attachment, str):
-                            print(f"      • {attachment}")
-            
-            print(f"  ✅ Enhanced режим: основные файлы и вложения уже обработаны")
-            
-            # 5. Enhanced поиск в контенте и других местах
-            content = data.get('content', '') or ''
-            if not content and data.get('post'):
-                content = data['post'].get('content', '') or ''
-            
-            print(f"  🔍 Enhanced: анализируем контент ({len(content)} символов)")
-            
-            # Ищем облачные ссылки в контенте
-            cloud_links = []
-            if content:
-                cloud_links = detect_cloud_links(content)
-                if cloud_links:
-                    print(f"  ☁️ Найдено облачных ссылок: {len(cloud_links)}")
-                    cloud_stats = {}
-                    for link_info in cloud_links:
-                        service = link_info['service']
-                        cloud_stats[service] = cloud_stats.get(service, 0) + 1
-                    
-                    for service, count in cloud_stats.items():
-                        print(f"      ☁️ {service}: {count}")
-            
-            # Ищем ссылки на файлы в контенте (фильтрация уже в find_media_links_in_content)
-            if content:
-                print(f"  🔍 Анализируем HTML контент поста ({len(content)} символов)...")
-                content_links = find_media_links_in_content(content)
-                if content_links:
-                    print(f"  ✅ Найдено ссылок в контенте: {len(content_links)}")
-                    # НЕ дублируем фильтрацию - она уже в find_media_links_in_content
-                    for link in content_links:
-                        if link not in media_links:  # Просто избегаем дубликатов
-                            media_links.append(link)
-                            filename = link.split('/')[-1].split('?')[0][:50]
-                            print(f"      ✅ Добавлена ссылка: {filename}...")
-                else:
-                    print(f"  ⚠️ В HTML контенте файлов не найдено")
-            
-        # 6. Проверка всех секций на видео файлы
-        all_video_sources = []
+        if not ('kemono.cr' in post_url and 'user' in parts and 'post' in parts):
+            raise ValueError("неверный формат URL поста")
         
-        # Проверяем post.attachments
-        if data.get('post', {}).get('attachments'):
-            all_video_sources.extend(data['post']['attachments'])
+        service_idx = parts.index('kemono.cr') + 1
+        user_idx = parts.index('user')
+        post_idx = parts.index('post')
         
-        # Проверяем корневые attachments
-        if data.get('attachments'):
-            all_video_sources.extend(data['attachments'])
-            
-        # Проверяем videos секцию
-        if data.get('videos'):
-            all_video_sources.extend(data['videos'])
-            
-        # Проверяем previews (могут содержать видео)
-        if data.get('previews'):
-            all_video_sources.extend(data['previews'])
+        service = parts[service_idx]
+        creator_id = parts[user_idx + 1]
+        post_id = parts[post_idx + 1]
+        
+        print(f"  📄 Получаем все файлы через API: {service}/{creator_id}/post/{post_id}")
+        
+        api_url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}/post/{post_id}"
+        response = http_get(api_url, headers=HEADERS, verify=False, timeout=15)
         
-        video_count = 0
-        for item in all_video_sources:
-            if isinstance(item, dict):
-                name = item.get('name', '').lower()
-                if any(ext in name for ext in ['.mp4', '.avi', '.mkv', '.mov', '.webm', '.gif']):
-                    video_count += 1
+        print(f"  📶 API Status: {response.status_code}")
+        
+        if response.status_code == 429 or response.status_code >= 500:
+            # Повторы исчерпаны - это сбой сервера, а не пост без файлов:
+            # пост должен остаться необработанным до следующей попытки
+            response.raise_for_status()
+        
+        if response.status_code != 200:
+            return []
         
+        print(f"  🔍 UNIVERSAL SEARCH - ищем ВСЕ типы файлов (3D, архивы, документы, медиа)")
+        
+        # Разбор JSON, вложений и контента - одним вызовом (в пуле процессов, если он включен)
+        attachments, content_links, cloud_links, content_length = run_parser(parse_post_data, response.content)
+        
+        # 1. Все файлы поста (основной файл, вложения, превью, видео)
+        for attachment in attachments:
+            print(f"    📎 {attachment.file_type}: {attachment.name} ({attachment.section})")
+        
+        video_count = sum(1 for attachment in attachments if attachment.is_video)
         if video_count > 0:
             print(f"  🎬 Enhanced: найдено видео файлов: {video_count}")
-            for item in all_video_sources:
-                if isinstance(item, dict):
-                    name = item.get('name', '')
-                    if any(ext in name.lower() for ext in ['.mp4', '.avi', '.mkv', '.mov', '.webm', '.gif']):
-                        print(f"      🎬 Видео: {name}")
-                        
-                        # Добавляем видео файлы в список если их еще нет
-                        file_path = item.get('path', '')
-                        if file_path:
-                            file_url = f"https://n3.kemono.cr/data{file_path}?f={name}"
-                            if file_url not in media_links:
-                                media_links.append(file_url)
-                                print(f"        📎 Добавлено: {file_url}")
+        
+        media_links = [attachment.url for attachment in attachments]
+        
+        # 2. Enhanced поиск в контенте
+        print(f"  🔍 Enhanced: анализируем контент ({content_length} символов)")
+        
+        # Облачные ссылки в контенте
+        if cloud_links:
+            print(f"  ☁️ Найдено облачных ссылок: {len(cloud_links)}")
+            cloud_stats = {}
+            for link_info in cloud_links:
+                service = link_info['service']
+                cloud_stats[service] = cloud_stats.get(service, 0) + 1
             
-        # Удаляем дубликаты и пересчитываем статистику
-        unique_links = list(dict.fromkeys(media_links))
-        
-        # Пересчитываем статистику файлов без дубликатов
-        found_files = []
-        for link in unique_links:
-            if '?f=' in link:
-                filename = link.split('?f=')[-1]
+            for service, count in cloud_stats.items():
+                print(f"      ☁️ {service}: {count}")
+        
+        # Ссылки на файлы в контенте (фильтрация уже в extract_content_links)
+        if content_length:
+            content_links = get_content_link_urls(content_links)
+            if content_links:
+                print(f"  ✅ Найдено ссылок в контенте: {len(content_links)}")
+                for link in add_content_links(media_links, attachments, content_links):
+                    print(f"      ✅ Добавлена ссылка: {get_link_filename(link)[:50]}...")
             else:
-                filename = link.split('/')[-1].split('?')[0]
-            file_type = get_file_type(filename)
-            found_files.append(file_type)
+                print(f"  ⚠️ В HTML контенте файлов не найдено")
         
-        if len(unique_links) > 0:
-            # Подсчитываем статистику по типам файлов
+        if media_links:
+            # Статистика по типам файлов: вложения - по записям, ссылки из контента - по имени
             file_stats = {}
-            for file_type in found_files:
+            file_types = [attachment.file_type for attachment in attachments]
+            file_types += [get_file_type(get_link_filename(link)) for link in media_links[len(attachments):]]
+            for file_type in file_types:
                 file_stats[file_type] = file_stats.get(file_type, 0) + 1
             
-            print(f"   🎯 Найдено {len(unique_links)} файлов:")
+            print(f"   🎯 Найдено {len(media_links)} файлов:")
             for file_type, count in file_stats.items():
                 print(f"     • {file_type}: {count}")
             
             print(f"   📋 Список файлов:")
-            for f in unique_links:
-                # Получаем имя файла для отображения
-                if '?f=' in f:
-                    display_name = f.split('?f=')[-1]
-                else:
-                    display_name = f.split('/')[-1]
-                file_type = get_file_type(display_name)
-                print(f"     📎 {display_name} ({file_type})")
+            for link, file_type in zip(media_links, file_types):
+                print(f"     📎 {get_link_filename(link)} ({file_type})")
         else:
             print(f"   ⚠️ API не нашел файлы, пробуем HTML парсинг...")
             # Если API не нашел медиа, пробуем HTML
@@ -644,10 +821,10 @@ def get_post_media(post_url, enhanced_search=True, save_dir=None):
                 return html_media
             else:
                 print(f"   ❌ Файлы не найдены")
-            
+        
         # ИСПРАВЛЕНО: только сохраняем облачные ссылки, но НЕ скачиваем их сразу
         # Скачивание будет происходить отдельно в основном цикле
-        if 'cloud_links' in locals() and cloud_links and CLOUD_AUTO_ENABLED:
+        if cloud_links and CLOUD_AUTO_ENABLED:
             try:
                 print(f"  ☁️ Найдено облачных ссылок: {len(cloud_links)}")
                 # Только сохраняем ссылки для истории, но НЕ скачиваем сейчас
@@ -663,75 +840,503 @@ def get_post_media(post_url, enhanced_search=True, save_dir=None):
             except Exception as e:
                 print(f"  ⚠️ Ошибка обработки облачных ссылок: {e}")
         
-        return unique_links
-            
+        return media_links
+    
+    except requests.RequestException as e:
+        # Сеть, исчерпанные повторы или открытый circuit breaker: в HTML fallback
+        # не идем - пустой результат отметил бы пост обработанным без файлов
+        print(f"  ❌ API недоступен, пост остается необработанным: {e}")
+        raise
     except Exception as e:
         print(f"  ❌ Ошибка парсинга URL или API: {e}")
         # Пробуем HTML fallback если API не сработал
         print(f"  🔄 Переключаемся на HTML парсинг...")
         return get_post_media_from_html_fallback(post_url)
 
-def is_file_complete(filepath, expected_size=None):
-    """Проверяет, что файл скачан полностью"""
+def is_file_complete(filepath, expected_size=None, expected_sha256=None, recorded=None):
+    """
+    Проверяет, что файл скачан полностью.
+    expected_sha256 - хеш из пути CDN: файл сверяется с ним по содержимому.
+    recorded - запись о файле из прогресса: если там уже есть проверенный
+    хеш и размер совпадает, файл повторно не читается
+    """
     if not os.path.exists(filepath):
         return False
     
     file_size = os.path.getsize(filepath)
     
-    # Файл считается неполным если он меньше 1KB (может быть обрезан)
-    if file_size < 1024:
+    # Пустой файл - точно обрыв (маленькие файлы бывают и настоящими)
+    if file_size == 0:
         return False
     
     # Если знаем ожидаемый размер, проверяем соответствие
     if expected_size and file_size != expected_size:
         return False
     
+    if expected_sha256:
+        if recorded and recorded.get('sha256') == expected_sha256 and recorded.get('size') == file_size:
+            return True
+        return file_sha256(filepath) == expected_sha256
+    
     return True
 
 def get_download_progress_file(save_dir):
     """Возвращает путь к файлу прогресса загрузки"""
     return os.path.join(save_dir, '.kemono_progress.json')
 
+def get_progress_journal_file(save_dir):
+    """Журнал изменений прогресса с последнего снимка (JSON Lines)"""
+    return os.path.join(save_dir, '.kemono_progress.jsonl')
+
+# После скольких записей журнала переписываем снимок прогресса целиком
+JOURNAL_COMPACT_LINES = 2000
+
+# Блокировки прогресса по папкам: файлы завершаются из нескольких потоков
+_progress_locks = {}
+_progress_locks_lock = threading.Lock()
+# Количество записей в журнале каждой папки с последнего снимка
+_journal_lines = {}
+
+def _get_progress_lock(save_dir):
+    key = os.path.abspath(save_dir)
+    with _progress_locks_lock:
+        if key not in _progress_locks:
+            _progress_locks[key] = threading.RLock()
+        return _progress_locks[key]
+
+class IndexedList(list):
+    """
+    Список с множеством-индексом: проверка "in" за O(1), порядок и JSON формат
+    как у обычного списка. Для completed_posts - при резюме авторов
+    с десятками тысяч постов проверки не должны сканировать список
+    """
+    
+    def __init__(self, items=()):
+        super().__init__(items)
+        self._index = set(self)
+    
+    def __contains__(self, item):
+        return item in self._index
+    
+    def append(self, item):
+        super().append(item)
+        self._index.add(item)
+    
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        self._index.update(items)
+    
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+    
+    def _reindex(self):
+        self._index = set(self)
+    
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._index.add(item)
+    
+    def remove(self, item):
+        super().remove(item)
+        self._reindex()
+    
+    def pop(self, *args):
+        item = super().pop(*args)
+        self._reindex()
+        return item
+    
+    def clear(self):
+        super().clear()
+        self._index.clear()
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._reindex()
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._reindex()
+
+def _index_progress(progress):
+    """Переводит completed_posts загруженного прогресса на IndexedList"""
+    if not isinstance(progress.get('completed_posts'), IndexedList):
+        progress['completed_posts'] = IndexedList(progress.get('completed_posts') or [])
+    if not isinstance(progress.get('completed_files'), dict):
+        progress['completed_files'] = {}
+    return progress
+
+def _new_progress():
+    return {'completed_posts': IndexedList(), 'completed_files': {}, 'started_at': None, 'last_update': None}
+
+def _apply_journal_entry(progress, entry):
+    """Применяет одну запись журнала к словарю прогресса"""
+    op = entry.get('op')
+    if op == 'file':
+        progress.setdefault('completed_files', {})[entry['id']] = entry['info']
+    elif op == 'post':
+        completed_posts = progress.setdefault('completed_posts', IndexedList())
+        if entry['id'] not in completed_posts:
+            completed_posts.append(entry['id'])
+        if entry.get('version'):
+            progress.setdefault('post_versions', {})[entry['id']] = entry['version']
+    elif op == 'set':
+        progress[entry['key']] = entry['value']
+    if entry.get('at'):
+        progress['last_update'] = entry['at']
+
+# Необязательное хранилище прогресса в SQLite (None - JSON файлы в папках авторов)
+_progress_db = None
+
+def set_progress_database(db_path):
+    """
+    Включает хранилище прогресса в SQLite (одна база на библиотеку) или,
+    при db_path=None, возвращает JSON файлы. Прогресс авторов из JSON
+    переносится в базу при первой загрузке, сами файлы не удаляются
+    """
+    global _progress_db
+    _progress_db = ProgressDatabase(db_path) if db_path else None
+    if _progress_db:
+        mirror_manager.import_state(_progress_db.load_mirrors())
+        print(f"🗄️ Прогресс хранится в SQLite: {db_path}")
+
+def get_progress_database():
+    """Текущее хранилище прогресса SQLite или None"""
+    return _progress_db
+
+# Необязательное хранилище файлов по хешу (None - файлы просто лежат в папках авторов)
+_blob_store = None
+
+def set_blob_store(root):
+    """Включает хранилище файлов по хешу в папке root (None - выключает)"""
+    global _blob_store
+    _blob_store = BlobStore(root) if root else None
+    if _blob_store:
+        print(f"🔗 Дедупликация файлов по хешу: {root}")
+
+# Необязательный пул процессов для разбора постов: JSON/HTML разбирается на всех
+# ядрах, а не в одном процессе с потоками скачивания и GUI (GIL)
+PARSE_PROCESSES = max(1, (os.cpu_count() or 2) - 1)
+_parse_pool = None
+_parse_processes = 0
+_parse_pool_lock = threading.Lock()
+
+def set_parse_processes(processes):
+    """Включает разбор постов в processes процессах (0 или None - разбор в текущем процессе)"""
+    global _parse_pool, _parse_processes
+    processes = processes or 0
+    with _parse_pool_lock:
+        # Уже запущенный пул того же размера оставляем (запуск процессов не бесплатный)
+        if processes == _parse_processes:
+            return
+        _parse_processes = processes
+        if _parse_pool:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+        # spawn - дочерние процессы не наследуют потоки и Qt главного процесса
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn')) if processes else None
+    if processes:
+        print(f"🧮 Разбор постов в {processes} процессах")
+
+def run_parser(func, *args):
+    """
+    Выполняет разбор func(*args) в пуле процессов, если он включен.
+    Если пул сломался (процесс упал), разбор выполняется здесь же
+    """
+    global _parse_pool
+    pool = _parse_pool
+    if pool:
+        try:
+            return pool.submit(func, *args).result()
+        except (BrokenProcessPool, RuntimeError) as e:
+            print(f"⚠️ Пул разбора недоступен ({e}), разбираем в текущем процессе")
+            with _parse_pool_lock:
+                if _parse_pool is pool:
+                    _parse_pool = None
+    return func(*args)
+
 def load_download_progress(save_dir):
-    """Загружает прогресс загрузки из JSON файла"""
+    """Загружает прогресс загрузки автора"""
+    with _get_progress_lock(save_dir):
+        if not _progress_db:
+            return _index_progress(_load_progress_files(save_dir))
+        
+        progress = _progress_db.load(save_dir)
+        if progress is None:
+            # Первое открытие папки с базой - переносим прогресс из JSON
+            progress = _load_progress_files(save_dir)
+            if progress.get('started_at'):
+                print(f"📦 Прогресс перенесен из JSON в SQLite: {len(progress.get('completed_files', {}))} файлов")
+            _progress_db.save(save_dir, progress)
+        return _index_progress(progress)
+
+def _load_progress_files(save_dir):
+    """Загружает прогресс загрузки: снимок из JSON файла + записи журнала после него"""
     progress_file = get_download_progress_file(save_dir)
+    journal_file = get_progress_journal_file(save_dir)
     
-    if not os.path.exists(progress_file):
-        return {'completed_posts': [], 'completed_files': {}, 'started_at': None, 'last_update': None}
+    with _get_progress_lock(save_dir):
+        progress = _new_progress()
+        if os.path.exists(progress_file):
+            try:
+                with open(progress_file, 'r', encoding='utf-8') as f:
+                    progress = _index_progress(json.load(f))
+            except Exception as e:
+                print(f"⚠️ Ошибка загрузки прогресса: {e}")
+                progress = _new_progress()
+        
+        lines = 0
+        if os.path.exists(journal_file):
+            try:
+                with open(journal_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # Оборванная запись при аварийном завершении
+                        _apply_journal_entry(progress, entry)
+                        lines += 1
+            except Exception as e:
+                print(f"⚠️ Ошибка чтения журнала прогресса: {e}")
+        _journal_lines[os.path.abspath(save_dir)] = lines
     
-    try:
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"⚠️ Ошибка загрузки прогресса: {e}")
-        return {'completed_posts': [], 'completed_files': {}, 'started_at': None, 'last_update': None}
+    return progress
 
 def save_download_progress(save_dir, progress):
-    """Сохраняет прогресс загрузки в JSON файл"""
+    """
+    Сохраняет полный снимок прогресса в JSON файл и очищает журнал.
+    Для отдельных файлов и постов - append_progress_entry (без перезаписи всего файла)
+    """
     progress_file = get_download_progress_file(save_dir)
-    progress['last_update'] = datetime.now().isoformat()
+    journal_file = get_progress_journal_file(save_dir)
     
-    try:
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"⚠️ Ошибка сохранения прогресса: {e}")
+    with _get_progress_lock(save_dir):
+        progress['last_update'] = datetime.now().isoformat()
+        if _progress_db:
+            _progress_db.save(save_dir, progress)
+            return
+        
+        temp_file = progress_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(progress, f, indent=2, ensure_ascii=False)
+            os.replace(temp_file, progress_file)
+            # Все записи журнала уже в снимке
+            if os.path.exists(journal_file):
+                os.remove(journal_file)
+            _journal_lines[os.path.abspath(save_dir)] = 0
+        except Exception as e:
+            print(f"⚠️ Ошибка сохранения прогресса: {e}")
+
+def append_progress_entry(save_dir, progress, entry):
+    """
+    Применяет изменение к прогрессу и дописывает его строкой в журнал.
+    Когда журнал вырастает до JOURNAL_COMPACT_LINES, снимок переписывается целиком
+    """
+    entry['at'] = datetime.now().isoformat()
+    key = os.path.abspath(save_dir)
+    
+    with _get_progress_lock(save_dir):
+        _apply_journal_entry(progress, entry)
+        if _progress_db:
+            _progress_db.apply(save_dir, entry)
+            return
+        
+        try:
+            with open(get_progress_journal_file(save_dir), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except Exception as e:
+            print(f"⚠️ Ошибка записи журнала прогресса: {e}")
+            return
+        
+        _journal_lines[key] = _journal_lines.get(key, 0) + 1
+        if _journal_lines[key] >= JOURNAL_COMPACT_LINES:
+            save_download_progress(save_dir, progress)
+
+def record_file_completed(save_dir, progress, file_id, file_info):
+    """Записывает скачанный файл в прогресс"""
+    append_progress_entry(save_dir, progress, {'op': 'file', 'id': file_id, 'info': file_info})
+
+def record_progress_value(save_dir, progress, key, value):
+    """Записывает отдельное поле прогресса"""
+    append_progress_entry(save_dir, progress, {'op': 'set', 'key': key, 'value': value})
+
+def get_post_version(post):
+    """Версия поста из листинга: время последней правки, иначе публикации"""
+    return post.get('edited') or post.get('published')
+
+def select_pending_posts(post_urls, progress_data, post_versions=None):
+    """
+    Выбирает посты к обработке: новые и те, у которых изменилась версия
+    (edited/published) с прошлого раза. post_versions - {post_url: версия}.
+    Возвращает (pending_posts, количество измененных)
+    """
+    post_versions = post_versions or {}
+    completed_posts = _index_progress(progress_data)['completed_posts']
+    stored_versions = progress_data.setdefault('post_versions', {})
+    pending_posts = []
+    changed = 0
+    
+    for post_url in post_urls:
+        post_id = hashlib.md5(post_url.encode()).hexdigest()
+        version = post_versions.get(post_url)
+        if post_id not in completed_posts:
+            pending_posts.append(post_url)
+        elif version and post_id not in stored_versions:
+            # Пост обработан до появления версий - запоминаем текущую как исходную
+            stored_versions[post_id] = version
+        elif version and stored_versions[post_id] != version:
+            pending_posts.append(post_url)
+            changed += 1
+    
+    return pending_posts, changed
+
+def record_post_completed(save_dir, progress_data, post_id, version=None):
+    """Отмечает пост обработанным и запоминает его версию"""
+    append_progress_entry(save_dir, progress_data, {'op': 'post', 'id': post_id, 'version': version})
+
+def filter_new_media(media_links, progress_data):
+    """
+    Убирает ссылки, которые уже скачаны и лежат на диске -
+    у измененного поста качаются только новые вложения
+    """
+    completed_files = progress_data.get('completed_files', {}) if progress_data else {}
+    new_links = []
+    for url in media_links:
+        file_info = completed_files.get(hashlib.md5(url.encode()).hexdigest())
+        if file_info and os.path.exists(file_info.get('filepath', '')):
+            continue
+        new_links.append(url)
+    return new_links
+
+# Нижняя граница потоков в адаптивном режиме по умолчанию
+ADAPTIVE_MIN_WORKERS = 2
+
+class AdaptiveConcurrency:
+    """
+    AIMD регулятор количества одновременных скачиваний.
+    Раз в interval секунд смотрит на общую скорость, ошибки и ответы 429/5xx:
+    нет проблем и скорость не падает - +1 слот, есть перегрузка - слоты делятся пополам.
+    """
+    
+    # Доля ошибок за интервал, после которой считаем канал перегруженным
+    ERROR_RATE_LIMIT = 0.1
+    # Падение скорости, при котором перестаем добавлять слоты
+    SPEED_DROP_TOLERANCE = 0.9
+    
+    def __init__(self, min_workers, max_workers, initial=None, interval=5.0):
+        self.min_workers = max(1, min(min_workers, max_workers))
+        self.max_workers = max_workers
+        self.limit = max(self.min_workers, min(initial or self.min_workers, max_workers))
+        self.interval = interval
+        self.active = 0
+        self._condition = threading.Condition()
+        self._last = network_stats.snapshot()
+        self._last_speed = None
+    
+    def acquire(self, stop_check=None):
+        """Ждет свободный слот. Возвращает False если скачивание остановлено"""
+        with self._condition:
+            while self.active >= self.limit:
+                if stop_check and stop_check():
+                    return False
+                self._condition.wait(0.5)
+                self._adjust()
+            self.active += 1
+            return True
+    
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._adjust()
+            self._condition.notify_all()
+    
+    def _adjust(self):
+        """Пересчитывает лимит слотов (вызывается под self._condition)"""
+        current = network_stats.snapshot()
+        elapsed = current['time'] - self._last['time']
+        if elapsed < self.interval:
+            return
+        
+        requests_count = current['requests'] - self._last['requests']
+        errors = current['errors'] - self._last['errors']
+        throttled = current['throttled'] - self._last['throttled']
+        speed = (current['bytes'] - self._last['bytes']) / elapsed
+        self._last = current
+        
+        old_limit = self.limit
+        error_rate = errors / requests_count if requests_count else 0
+        
+        if throttled or error_rate > self.ERROR_RATE_LIMIT:
+            # Мультипликативное уменьшение при перегрузке сервера
+            self.limit = max(self.min_workers, self.limit // 2)
+            reason = f"429/5xx: {throttled}, ошибок: {errors}"
+        elif self.active >= self.limit and (self._last_speed is None
+                                            or speed >= self._last_speed * self.SPEED_DROP_TOLERANCE):
+            # Аддитивное увеличение, пока все слоты заняты и скорость растет
+            self.limit = min(self.max_workers, self.limit + 1)
+            reason = f"{speed / 1024 / 1024:.1f} MB/s"
+        else:
+            reason = ""
+        
+        self._last_speed = speed
+        if self.limit != old_limit:
+            print(f"⚙️ Адаптивные потоки: {old_limit} → {self.limit} ({reason})")
+            self._condition.notify_all()
+
+# Сколько найденных ссылок может ждать скачивания, пока поиск не притормозит
+PIPELINE_QUEUE_SIZE = 200
+
+def iter_media_queue(media_queue, stop_check=None, poll_interval=0.5):
+    """
+    Отдает ссылки из очереди, которую наполняет поток поиска файлов,
+    до маркера None или до остановки
+    """
+    while not (stop_check and stop_check()):
+        try:
+            url = media_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            continue
+        if url is None:
+            return
+        yield url
 
 def download_files_parallel(media_links, save_dir, progress_data=None, max_workers=4, 
-                           thread_callback=None, overall_callback=None, stop_check=None):
+                           thread_callback=None, overall_callback=None, stop_check=None,
+                           segments=1, adaptive=False, min_workers=ADAPTIVE_MIN_WORKERS,
+                           file_callback=None):
     """
     Скачивает файлы параллельно в несколько потоков
+    media_links - список ссылок или итератор (например iter_media_queue), который
+                  отдает ссылки по мере их нахождения - скачивание идет параллельно с поиском
     thread_callback(thread_id, filename, progress, max_progress) - для обновления прогресса потоков
     overall_callback(current, total) - для обновления общего прогресса
     stop_check() - функция для проверки нужно ли остановить скачивание
+    segments - соединений на один большой файл (1 - без сегментирования)
+    adaptive - подбирать число активных потоков от min_workers до max_workers по скорости и ошибкам
+    file_callback(url, success) - вызывается после каждого файла
     """
-    if not media_links:
+    # Для итератора общее количество растет по мере поступления ссылок
+    streaming = not isinstance(media_links, (list, tuple))
+    if not streaming and not media_links:
         return 0
     
-    print(f"🚀 Многопоточное скачивание: {len(media_links)} файлов в {max_workers} потоков")
+    if streaming:
+        print(f"🚀 Многопоточное скачивание по мере поиска файлов в {max_workers} потоков")
+    else:
+        print(f"🚀 Многопоточное скачивание: {len(media_links)} файлов в {max_workers} потоков")
+    
+    concurrency = None
+    if adaptive:
+        concurrency = AdaptiveConcurrency(min_workers, max_workers)
+        print(f"⚙️ Адаптивный режим: от {concurrency.min_workers} до {max_workers} потоков")
     
     success_count = 0
-    total_count = len(media_links)
+    total_count = 0 if streaming else len(media_links)
     completed_files = 0
     
     # ИСПРАВЛЕНО: Инициализируем общий прогресс в начале
@@ -740,7 +1345,6 @@ def download_files_parallel(media_links, save_dir, progress_data=None, max_worke
     lock = threading.Lock()
     
     def download_with_progress(args):
-        nonlocal completed_files, success_count
         url, index = args
         thread_id = index % max_workers  # Логический ID потока (0-4)
         
@@ -748,6 +1352,20 @@ def download_files_parallel(media_links, save_dir, progress_data=None, max_worke
         if stop_check and stop_check():
             return False
         
+        # В адаптивном режиме ждем свободный слот
+        if concurrency:
+            if not concurrency.acquire(stop_check):
+                return False
+            try:
+                return download_one(url, thread_id)
+            finally:
+                concurrency.release()
+        
+        return download_one(url, thread_id)
+    
+    def download_one(url, thread_id):
+        nonlocal completed_files, success_count
+        
         # Получаем имя файла для отображения
         if '?f=' in url:
             filename = url.split('?f=')[-1]
@@ -772,7 +1390,7 @@ def download_files_parallel(media_links, save_dir, progress_data=None, max_worke
         if thread_callback:
             thread_callback(thread_id, filename, 50, 100)  # Показываем процесс
             
-        result = download_file(url, save_dir, progress_data)
+        result = download_file(url, save_dir, progress_data, segments=segments)
         
         with lock:
             completed_files += 1
@@ -790,14 +1408,33 @@ def download_files_parallel(media_links, save_dir, progress_data=None, max_worke
             status = '✅' if result else '❌'
             print(f"📥 [{completed_files}/{total_count}] Поток-{thread_id}: {status} {filename[:40]}")
         
+        if file_callback:
+            file_callback(url, result)
+        
         return result
     
-    # Подготавливаем задачи
-    tasks = [(url, i) for i, url in enumerate(media_links)]
+    # Не забираем из источника больше ссылок, чем потоки успеют взять в работу
+    in_flight = threading.Semaphore(max_workers * 2)
+    
+    def run_task(task):
+        try:
+            return download_with_progress(task)
+        finally:
+            in_flight.release()
     
     # Выполняем параллельно
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(download_with_progress, task) for task in tasks]
+        futures = []
+        for index, url in enumerate(media_links):
+            if stop_check and stop_check():
+                break
+            in_flight.acquire()
+            if streaming:
+                with lock:
+                    total_count += 1
+                    if overall_callback:
+                        overall_callback(completed_files, total_count)
+            futures.append(executor.submit(run_task, (url, index)))
         
         # Ждем завершения всех задач
         for future in as_completed(futures):
@@ -806,11 +1443,285 @@ def download_files_parallel(media_links, save_dir, progress_data=None, max_worke
             except Exception as e:
                 print(f"❌ Ошибка в потоке: {e}")
     
+    # Сбрасываем на диск последнюю пачку скачанных файлов
+    sync_batcher.flush()
+    
+    # Замеры зеркал пригодятся следующему запуску
+    if _progress_db:
+        _progress_db.save_mirrors(mirror_manager.export_state())
+    
     print(f"📊 Многопоточное скачивание завершено: {success_count}/{total_count} файлов")
     return success_count
 
-def download_file(url, save_dir, progress_data=None):
-    """Скачивает файл по URL с поддержкой резюме"""
+# Сколько раз подряд докачиваем файл после обрыва соединения
+RESUME_ATTEMPTS = 3
+
+def download_to_part(url, filepath, timeout=30, expected_sha256=None):
+    """
+    Скачивает URL во временный .part файл с докачкой через HTTP Range.
+    При успехе переименовывает .part в filepath.
+    expected_sha256 - хеш считается по ходу записи и сверяется в конце,
+    при несовпадении .part удаляется.
+    Возвращает (успех, HTTP статус или None)
+    """
+    part_path = get_part_path(filepath)
+    status = None
+    
+    for attempt in range(RESUME_ATTEMPTS):
+        started = time.time()
+        try:
+            response, mode, offset, total_size = open_resumable(
+                url, part_path, headers=HEADERS, verify=False, timeout=timeout)
+        except Exception as e:
+            print(f"    ⚠️ Ошибка соединения: {e}")
+            mirror_manager.observe(url, False)
+            return False, status
+        
+        ttfb = time.time() - started
+        status = response.status_code
+        
+        if mode is None:
+            response.close()
+            mirror_manager.observe(url, False, status=status)
+            return False, status
+        
+        # Хеш уже скачанной части считаем до докачки, дальше - по мере записи
+        digest = hashlib.sha256() if expected_sha256 else None
+        
+        if mode == 'complete':
+            response.close()
+            if digest:
+                hash_file(digest, part_path)
+        else:
+            if offset:
+                print(f"    ⏩ Докачка с {offset / 1024 / 1024:.1f} MB")
+            if total_size:
+                print(f"    📊 Размер: {total_size / 1024 / 1024:.1f} MB")
+            
+            try:
+                if digest and mode == 'append':
+                    hash_file(digest, part_path, limit=offset)
+                with open_part_file(part_path, mode, offset, total_size) as f:
+                    for chunk in response.iter_content(chunk_size=65536):  # 64KB chunks для скорости
+                        if chunk:
+                            f.write(chunk)
+                            if digest:
+                                digest.update(chunk)
+                            count_received(len(chunk))
+            except Exception as e:
+                # Обрыв соединения - .part остается на диске для докачки
+                print(f"    ⚠️ Обрыв соединения ({e}), докачиваем...")
+                continue
+            finally:
+                response.close()
+        
+        part_size = os.path.getsize(part_path)
+        if total_size and part_size < total_size:
+            print(f"    ⚠️ Получено {part_size} из {total_size} байт, докачиваем...")
+            continue
+        
+        if digest and digest.hexdigest() != expected_sha256:
+            # Битый файл на зеркале или испорченный .part - качаем заново с другого зеркала
+            print(f"    ❌ SHA-256 не совпал, файл поврежден")
+            clear_part_state(part_path, remove_part=True)
+            mirror_manager.observe(url, False, status=status)
+            return False, status
+        
+        finish_part(part_path, filepath)
+        
+        # Запоминаем TTFB/скорость зеркала и то, что файлы этого префикса лежат на нем
+        mirror_manager.observe(url, True, ttfb=ttfb, nbytes=part_size - offset,
+                               seconds=time.time() - started)
+        return True, status
+    
+    mirror_manager.observe(url, False, status=status)
+    return False, status
+
+# Сегментированное скачивание больших файлов в несколько соединений
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024  # Файлы от 64 MB
+SEGMENTED_CONNECTIONS = MAX_SEGMENTS_PER_FILE  # Соединений на один файл по умолчанию
+SEGMENT_STATE_SAVE_BYTES = 8 * 1024 * 1024  # Как часто сохранять состояние сегментов
+SEGMENT_FLUSH_BYTES = 2 * 1024 * 1024  # Как часто поток сбрасывает буфер своего сегмента
+
+def is_partial_download(filepath, url, progress_data=None):
+    """
+    Можно ли докачать существующий файл как начало файла url: он меньше файла
+    на сервере (и сервер поддерживает Range) и не записан в прогресс как
+    скачанный файл другой ссылки. У разных постов бывают одинаковые имена
+    (1.png, preview.jpg) - чужой готовый файл трогать нельзя
+    """
+    completed_files = progress_data.get('completed_files', {}) if progress_data else {}
+    for file_info in completed_files.values():
+        if file_info.get('filepath') == filepath and file_info.get('url') != url:
+            return False
+    
+    total_size, _ = probe_segmented(url, min_size=0)
+    return bool(total_size) and os.path.getsize(filepath) < total_size
+
+def probe_segmented(url, min_size=None):
+    """
+    Проверяет, стоит ли качать файл сегментами: сервер поддерживает Range
+    и размер не меньше порога. Возвращает (размер, ETag) или (None, None)
+    """
+    try:
+        response = http_head(url, headers=HEADERS, verify=False, timeout=15, allow_redirects=True)
+    except Exception:
+        return None, None
+    
+    if response.status_code != 200:
+        return None, None
+    
+    min_size = SEGMENTED_MIN_SIZE if min_size is None else min_size
+    total_size = response.headers.get('Content-Length', '')
+    accept_ranges = response.headers.get('Accept-Ranges', '').lower()
+    if not total_size.isdigit() or accept_ranges != 'bytes' or int(total_size) < min_size:
+        return None, None
+    
+    return int(total_size), response.headers.get('ETag')
+
+def plan_segments(total_size, connections):
+    """Делит файл на диапазоны [start, end, written] для параллельного скачивания"""
+    segment_size = -(-total_size // connections)  # Округление вверх
+    return [[start, min(start + segment_size, total_size) - 1, 0]
+            for start in range(0, total_size, segment_size)]
+
+def download_segmented(urls, filepath, total_size, etag=None, connections=SEGMENTED_CONNECTIONS,
+                       expected_sha256=None):
+    """
+    Скачивает большой файл несколькими соединениями по диапазонам байт.
+    Сегменты пишутся на свои места в заранее выделенный .part файл,
+    состояние сохраняется в .part.json, поэтому загрузку можно продолжить.
+    urls - зеркала одного файла (n1..nN), сегменты распределяются по ним.
+    expected_sha256 - собранный файл сверяется с хешем (сегменты идут не по порядку,
+    поэтому хеш считается один раз в конце).
+    """
+    part_path = get_part_path(filepath)
+    _, meta = load_part_state(part_path)
+    
+    # Продолжаем прошлые сегменты только если файл на сервере не изменился
+    if (meta.get('segments') and meta.get('total') == total_size
+            and (not etag or meta.get('etag') in (None, etag))):
+        segments = meta['segments']
+        done = sum(segment[2] for segment in segments)
+        print(f"    ⏩ Продолжаем сегменты: {done / 1024 / 1024:.1f} из {total_size / 1024 / 1024:.1f} MB")
+    else:
+        segments = plan_segments(total_size, connections)
+        # Выделяем место под весь файл сразу - сегменты пишутся на свои позиции
+        with open(part_path, 'wb') as f:
+            f.truncate(total_size)
+            preallocate(f, 0, total_size)
+    
+    state = {'url': urls[0], 'etag': etag, 'total': total_size, 'segments': segments}
+    save_part_state(part_path, state)
+    
+    print(f"    🧩 Сегментированное скачивание: {len(segments)} частей, {len(urls)} зеркал, "
+          f"{total_size / 1024 / 1024:.1f} MB")
+    
+    lock = threading.Lock()
+    downloaded = sum(segment[2] for segment in segments)
+    # В состояние для докачки попадают только байты, уже сброшенные из буферов файлов
+    durable = downloaded
+    last_saved = durable
+    last_percent = downloaded * 100 // total_size
+    
+    def fetch_segment(index):
+        nonlocal downloaded, last_percent
+        segment = segments[index]
+        start, end = segment[0], segment[1]
+        written = segment[2]  # Записано этим потоком (часть может быть еще в буфере файла)
+        
+        def publish(f):
+            """Сбрасывает буфер файла и только после этого учитывает записанное в состоянии сегментов"""
+            nonlocal durable, last_saved
+            f.flush()
+            with lock:
+                durable += written - segment[2]
+                segment[2] = written
+                
+                # Периодически сохраняем состояние сегментов для докачки
+                if durable - last_saved >= SEGMENT_STATE_SAVE_BYTES:
+                    save_part_state(part_path, state)
+                    last_saved = durable
+        
+        for attempt in range(RESUME_ATTEMPTS):
+            position = start + written
+            if position > end:
+                return True
+            
+            # Каждый сегмент начинает со своего зеркала, при ошибке переходит к следующему
+            segment_url = urls[(index + attempt) % len(urls)]
+            headers = dict(HEADERS)
+            headers['Range'] = f'bytes={position}-{end}'
+            headers['Accept-Encoding'] = 'identity'
+            
+            try:
+                response = http_get(segment_url, headers=headers, verify=False, timeout=30, stream=True)
+                try:
+                    content_range = parse_content_range(response.headers.get('Content-Range'))
+                    if response.status_code != 206 or not content_range or content_range[0] != position:
+                        continue
+                    
+                    with open(part_path, 'r+b', buffering=PART_WRITE_BUFFER) as f:
+                        f.seek(position)
+                        unflushed = 0
+                        try:
+                            for chunk in response.iter_content(chunk_size=65536):
+                                if not chunk:
+                                    continue
+                                # Не пишем за границу сегмента, даже если сервер прислал больше
+                                chunk = chunk[:end + 1 - (start + written)]
+                                f.write(chunk)
+                                written += len(chunk)
+                                unflushed += len(chunk)
+                                count_received(len(chunk))
+                                
+                                if unflushed >= SEGMENT_FLUSH_BYTES:
+                                    publish(f)
+                                    unflushed = 0
+                                
+                                with lock:
+                                    downloaded += len(chunk)
+                                    
+                                    # Общий прогресс по всем сегментам
+                                    percent = downloaded * 100 // total_size
+                                    if percent >= last_percent + 10:
+                                        last_percent = percent
+                                        print(f"    📥 Сегменты: {percent}% ({downloaded / 1024 / 1024:.1f} MB)")
+                                
+                                if start + written > end:
+                                    break
+                        finally:
+                            publish(f)
+                finally:
+                    response.close()
+            except Exception as e:
+                print(f"    ⚠️ Сегмент {index + 1}: обрыв соединения ({e}), продолжаем...")
+        
+        return start + written > end
+    
+    with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+        results = list(executor.map(fetch_segment, range(len(segments))))
+    
+    with lock:
+        save_part_state(part_path, state)
+    
+    if not all(results):
+        print(f"    ⚠️ Не все сегменты скачаны, продолжим при следующей попытке")
+        return False
+    
+    if expected_sha256 and file_sha256(part_path) != expected_sha256:
+        print(f"    ❌ SHA-256 не совпал, скачиваем файл заново одним потоком")
+        clear_part_state(part_path, remove_part=True)
+        return False
+    
+    finish_part(part_path, filepath)
+    return True
+
+def download_file(url, save_dir, progress_data=None, segments=1):
+    """
+    Скачивает файл по URL с поддержкой резюме (докачка .part файлов через HTTP Range).
+    segments > 1 - большие файлы (от SEGMENTED_MIN_SIZE) качаются в несколько соединений
+    """
     try:
         # Создаем папку если не существует
         if not os.path.exists(save_dir):
@@ -832,122 +1743,151 @@ def download_file(url, save_dir, progress_data=None):
         # Создаем уникальный ID файла для отслеживания
         file_id = hashlib.md5(url.encode()).hexdigest()
         
+        def record_progress(domain=None):
+            """Записывает скачанный файл в прогресс"""
+            if progress_data:
+                file_info = {
+                    'url': url,
+                    'filename': safe_filename,
+                    'filepath': filepath,
+                    'size': os.path.getsize(filepath),
+                    'completed_at': datetime.now().isoformat()
+                }
+                if domain:
+                    file_info['domain'] = domain
+                if blob_key:
+                    file_info['blob'] = blob_key
+                if expected_sha256:
+                    # Хеш проверен - при следующих запусках файл не перечитывается
+                    file_info['sha256'] = expected_sha256
+                record_file_completed(save_dir, progress_data, file_id, file_info)
+        
+        # Хеш содержимого из пути CDN (/data/ce/15/ce152b1d...png)
+        expected_sha256 = url_sha256(url)
+        
+        # Хранилище по хешу: файл, уже скачанный для любого поста или автора,
+        # не качается повторно - в папку кладется жесткая ссылка на него
+        blob_key = _blob_store.key_for(url) if _blob_store else None
+        if blob_key:
+            filepath = _blob_store.resolve_target(filepath, blob_key)
+            safe_filename = os.path.basename(filepath)
+            # В хранилище попадают только проверенные файлы - хеш блоба не пересчитываем
+            if _blob_store.has(blob_key) and is_file_complete(_blob_store.blob_path(blob_key)):
+                _blob_store.link(blob_key, filepath)
+                print(f"🔗 Уже есть в хранилище: {safe_filename}")
+                record_progress()
+                return True
+        
         # Проверяем существование и полноту файла
+        recorded = progress_data.get('completed_files', {}).get(file_id) if progress_data else None
+        file_complete = os.path.exists(filepath) and is_file_complete(
+            filepath, expected_sha256=expected_sha256, recorded=recorded)
+        
+        # Под этим именем лежит другой файл (хеш не совпал, и это не его начало) -
+        # его не трогаем, новый файл сохраняем рядом с началом хеша в имени
+        if (os.path.exists(filepath) and not file_complete and expected_sha256
+                and (os.path.exists(hashed_filepath(filepath, expected_sha256))
+                     or not is_partial_download(filepath, url, progress_data))):
+            taken_filename = safe_filename
+            filepath = hashed_filepath(filepath, expected_sha256)
+            safe_filename = os.path.basename(filepath)
+            print(f"⚠️ Имя {taken_filename} занято другим файлом, сохраняем как {safe_filename}")
+            file_complete = os.path.exists(filepath) and is_file_complete(
+                filepath, expected_sha256=expected_sha256, recorded=recorded)
+        
+        part_path = get_part_path(filepath)
+        
         if os.path.exists(filepath):
-            if is_file_complete(filepath):
+            if file_complete:
                 print(f"✅ Уже скачано: {safe_filename}")
+                if blob_key:
+                    _blob_store.adopt(filepath, blob_key)
                 
                 # Обновляем прогресс
-                if progress_data:
-                    progress_data['completed_files'][file_id] = {
-                        'url': url,
-                        'filename': safe_filename,
-                        'filepath': filepath,
-                        'size': os.path.getsize(filepath),
-                        'completed_at': datetime.now().isoformat()
-                    }
-                    save_download_progress(save_dir, progress_data)
+                record_progress()
                 
                 return True
             else:
-                print(f"⚠️ Файл поврежден, перекачиваем: {safe_filename}")
-                os.remove(filepath)
-        
-        # Пробуем скачать с оригинального URL
-        start_time = time.time()
-        response = requests.get(url, headers=HEADERS, verify=False, timeout=15, stream=True)
+                # Неполный файл от старых версий - продолжаем его вместо скачивания с нуля
+                print(f"⚠️ Файл неполный, докачиваем: {safe_filename}")
+                if os.path.exists(part_path):
+                    os.remove(filepath)
+                else:
+                    os.replace(filepath, part_path)
+        elif os.path.exists(part_path):
+            print(f"⏩ Найден недокачанный файл: {safe_filename}")
         
-        if response.status_code == 200:
-            # Получаем размер файла если доступен
-            total_size = response.headers.get('content-length')
-            if total_size:
-                total_size = int(total_size)
-                print(f"    📊 Размер: {total_size / 1024 / 1024:.1f} MB")
-            
-            with open(filepath, 'wb') as f:
-                downloaded = 0
-                for chunk in response.iter_content(chunk_size=65536):  # 64KB chunks для скорости
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-            
+        def complete_download(domain=None):
+            """Проверяет скачанный файл и записывает его в прогресс"""
             file_size = os.path.getsize(filepath)
-            download_time = time.time() - start_time
-            speed_mbps = (file_size / 1024 / 1024) / download_time if download_time > 0 else 0
-            
-            # Проверяем что файл скачался полностью
-            if is_file_complete(filepath):
-                print(f"    ✅ Скачано: {safe_filename} ({file_size / 1024 / 1024:.1f} MB, {speed_mbps:.1f} MB/s)")
-                
-                # Обновляем прогресс
-                if progress_data:
-                    progress_data['completed_files'][file_id] = {
-                        'url': url,
-                        'filename': safe_filename,
-                        'filepath': filepath,
-                        'size': file_size,
-                        'completed_at': datetime.now().isoformat()
-                    }
-                    save_download_progress(save_dir, progress_data)
-                
-                return True
-            else:
+            if not is_file_complete(filepath):
                 print(f"    ❌ Файл скачался неполностью: {safe_filename}")
                 os.remove(filepath)  # Удаляем поврежденный файл
                 return False
-        
-        # Если оригинальный не работает, пробуем другие домены
-        print(f"    ⚠️ Оригинал недоступен ({response.status_code}), ищем на других доменах...")
-        
-        # Извлекаем путь из URL
-        import re
-        match = re.search(r'n\d+\.kemono\.cr(/data/.*)', url)
-        if match:
-            data_path = match.group(1)
             
-            # Пробуем разные домены kemono
-            domains = ['n1', 'n2', 'n3', 'n4', 'n5', 'n6']
+            download_time = time.time() - start_time
+            speed_mbps = (file_size / 1024 / 1024) / download_time if download_time > 0 else 0
+            source = f" с {domain}" if domain else ""
+            print(f"    ✅ Скачано{source}: {safe_filename} ({file_size / 1024 / 1024:.1f} MB, {speed_mbps:.1f} MB/s)")
+            
+            if blob_key:
+                _blob_store.adopt(filepath, blob_key)
             
-            for domain in domains:
+            # Обновляем прогресс
+            record_progress(domain)
+            
+            return True
+        
+        start_time = time.time()
+        success, status = False, None
+        
+        # Файлы CDN пробуем сначала на лучшем зеркале: том, что уже отдавало
+        # этот префикс хеша, или самом быстром по замерам
+        url_mirror, data_path, query = mirror_manager.split_url(url)
+        if data_path:
+            first_mirror = mirror_manager.candidates(data_path, preferred=url_mirror)[0]
+            first_url = mirror_manager.mirror_url(first_mirror, data_path, query)
+        else:
+            first_mirror, first_url = None, url
+        
+        # Недокачанные сегменты прошлой попытки продолжаем сегментами при любом
+        # segments - одним потоком .part обрезался бы до непрерывного начала
+        has_segments = bool(load_part_state(part_path)[1].get('segments'))
+        if segments > 1 or has_segments:
+            total_size, etag = probe_segmented(first_url, min_size=0 if has_segments else None)
+            if total_size:
+                urls = [first_url]
+                if data_path:
+                    # Сегменты распределяем по всем зеркалам, на которых есть файл
+                    urls += [mirror_manager.mirror_url(mirror, data_path, query)
+                             for mirror in mirror_manager.probe(data_path, HEADERS, exclude=[first_mirror])]
+                success = download_segmented(urls, filepath, total_size, etag, connections=max(segments, 1),
+                                             expected_sha256=expected_sha256)
+                if not success and load_part_state(part_path)[1].get('segments'):
+                    # Скачанные сегменты остаются в .part.json - следующая попытка
+                    # докачает только недостающие (одним потоком они бы пропали)
+                    return False
+        
+        if not success:
+            success, status = download_to_part(first_url, filepath, timeout=15,
+                                               expected_sha256=expected_sha256)
+        
+        if success:
+            return complete_download(first_mirror if first_mirror != url_mirror else None)
+        
+        # Если зеркало не отдало файл, параллельно проверяем остальные
+        # (вместо последовательных HEAD запросов к n1..n6)
+        if data_path:
+            print(f"    ⚠️ {first_mirror} недоступен ({status}), ищем на других зеркалах...")
+            
+            for mirror in mirror_manager.probe(data_path, HEADERS, exclude=[first_mirror]):
                 try:
-                    test_url = f"https://{domain}.kemono.cr{data_path}"
-                    
-                    # Быстрая проверка HEAD запросом
-                    head_response = requests.head(test_url, headers=HEADERS, verify=False, timeout=15)
-                    
-                    if head_response.status_code == 200:
-                        # Если HEAD успешен, скачиваем файл
-                        response = requests.get(test_url, headers=HEADERS, verify=False, timeout=30, stream=True)
-                        
-                        if response.status_code == 200:
-                            with open(filepath, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    if chunk:
-                                        f.write(chunk)
-                            
-                            file_size = os.path.getsize(filepath)
-                            
-                            # Проверяем целостность
-                            if is_file_complete(filepath):
-                                print(f"    ✅ Найдено на {domain}: {safe_filename} ({file_size} байт)")
-                                
-                                # Обновляем прогресс
-                                if progress_data:
-                                    progress_data['completed_files'][file_id] = {
-                                        'url': url,
-                                        'filename': safe_filename,
-                                        'filepath': filepath,
-                                        'size': file_size,
-                                        'completed_at': datetime.now().isoformat(),
-                                        'domain': domain
-                                    }
-                                    save_download_progress(save_dir, progress_data)
-                                
-                                return True
-                            else:
-                                print(f"    ❌ Файл поврежден на {domain}: {safe_filename}")
-                                os.remove(filepath)
-                
+                    mirror_url = mirror_manager.mirror_url(mirror, data_path, query)
+                    # Скачиваем файл (докачивая уже полученную часть)
+                    success, status = download_to_part(mirror_url, filepath, timeout=30,
+                                                       expected_sha256=expected_sha256)
+                    if success:
+                        return complete_download(mirror)
                 except Exception:
                     continue
         
@@ -975,165 +1915,216 @@ def extract_creator_info(url):
     
     return None, None
 
+# Расширения, по которым в тексте поста распознаются ссылки на файлы
+CONTENT_FILE_EXTENSIONS = (
+    'glb|gltf|blend|fbx|obj|dae|3ds|max|ma|mb'  # 3D модели
+    '|mp4|avi|mkv|mov|webm|flv|wmv|m4v|mpg|mpeg'  # Видео
+    '|png|jpg|jpeg|gif|bmp|tiff|tga|psd|webp|svg'  # Изображения
+    '|zip|rar|7z|tar|gz|bz2|xz'  # Архивы
+    '|pdf|doc|docx|txt|rtf'  # Документы
+    '|mp3|wav|flac|ogg|m4a|aac'  # Аудио
+    '|unity|unitypackage|prefab|asset'  # Unity
+    '|dds|hdr|exr|mat'  # Текстуры
+    '|exe|msi|dmg|apk|ipa'  # Приложения
+)
+
+# Один проход по контенту: HTML тег целиком или ссылка в тексте
+CONTENT_TOKEN_RE = re.compile(r'<([a-zA-Z][\w:-]*)([^<>]*)>|(https?://[^\s<>"]+)')
+CONTENT_ATTR_RE = re.compile(r'(href|src)="([^"]*)"', re.IGNORECASE)
+CONTENT_URL_RE = re.compile(r'https?://[^\s<>"]+', re.IGNORECASE)
+# Ссылка в тексте обрезается по последнему расширению файла (как .png в ...png?f=).
+# Расширение должно заканчиваться целиком: .mat не обрезается до .ma, .docx до .doc
+CONTENT_FILE_URL_RE = re.compile(rf'.*\.(?:{CONTENT_FILE_EXTENSIONS})(?![A-Za-z0-9])', re.IGNORECASE | re.DOTALL)
+
+# Признаки медиа в атрибутах href/src
+FILE_THUMB_RE = re.compile(r'class="[^"]*fileThumb[^"]*image-link', re.IGNORECASE)
+KEMONO_DOMAIN_RE = re.compile(r'kemono\.(?:cr|party)', re.IGNORECASE)
+KEMONO_DATA_RE = re.compile(r'kemono\.(?:cr|party).*/data/', re.IGNORECASE | re.DOTALL)
+KEMONO_CDN_RE = re.compile(r'https?://n[0-9]+\.kemono\.cr/', re.IGNORECASE)
+IMG_MEDIA_RE = re.compile(r'\.(?:png|jpg|jpeg|gif|webp|svg|bmp|tiff|tga|psd|mp4|avi|mkv|mov|webm)', re.IGNORECASE)
+LINK_MEDIA_RE = re.compile(r'\.(?:mp4|avi|mkv|mov|webm|zip|rar|7z|jpg|png|gif|jpeg|webp|bmp)', re.IGNORECASE)
+HEX_DIR_MEDIA_RE = re.compile(r'/[0-9a-f]{2}/[0-9a-f]{2}/.*\.(?:png|jpg|jpeg|gif|webp|svg|bmp|mp4|avi|mkv|mov)',
+                              re.IGNORECASE | re.DOTALL)
+
+# Облачные хранилища - их ссылки обрабатывает detect_cloud_links, а не загрузчик файлов
+# (kemono.cr сюда не входит!)
+CLOUD_DOMAIN_RE = re.compile(
+    r'drive\.google\.com|mega\.nz|mega\.co\.nz|dropbox\.com|onedrive\.live\.com|1drv\.ms'
+    r'|mediafire\.com|we\.tl|wetransfer\.com|pcloud\.com|disk\.yandex\.|box\.com|icloud\.com',
+    re.IGNORECASE)
+PATREON_MEDIA_RE = re.compile(r'patreon\.com/media-u', re.IGNORECASE)
+
+# Ссылка, найденная в контенте поста: source - 'html' (атрибут тега) или 'text'
+ContentLink = namedtuple('ContentLink', ['url', 'source'])
+
+def is_media_attribute(tag, attr, value, attrs):
+    """Подходит ли значение href/src тега под ссылку на медиа kemono"""
+    tag = tag.lower()
+    attr = attr.lower()
+    if tag == 'a' and attr == 'href' and (FILE_THUMB_RE.search(attrs) or LINK_MEDIA_RE.search(value)):
+        return True
+    if tag == 'img' and attr == 'src':
+        if KEMONO_DOMAIN_RE.search(value) or (value.startswith('/') and IMG_MEDIA_RE.search(value)):
+            return True
+    return bool(KEMONO_DATA_RE.search(value) or value.startswith('/data/')
+                or HEX_DIR_MEDIA_RE.match(value) or KEMONO_CDN_RE.match(value))
+
+def iter_text_file_links(text):
+    """Ссылки на файлы в тексте: обрезка по расширению и ссылки на данные kemono целиком"""
+    for match in CONTENT_URL_RE.finditer(text):
+        run = match.group(0)
+        position = 0
+        while position < len(run):
+            file_match = CONTENT_FILE_URL_RE.match(run, position)
+            if not file_match:
+                break
+            yield file_match.group(0)
+            # После найденного файла в той же строке может начинаться следующая ссылка
+            next_url = CONTENT_URL_RE.search(run, file_match.end())
+            if not next_url:
+                break
+            position = next_url.start()
+        
+        if KEMONO_DATA_RE.search(run):
+            yield run
+        else:
+            cdn_match = KEMONO_CDN_RE.search(run)
+            if cdn_match:
+                yield run[cdn_match.start():]
+
+def extract_content_links(content):
+    """
+    Находит ссылки на медиа файлы в контенте поста за один проход:
+    теги разбираются по атрибутам href/src, ссылки в тексте - по расширениям.
+    Облачные ссылки отбрасываются. Возвращает список ContentLink без повторов
+    """
+    links = []
+    seen_links = set()
+    
+    def add(url, source):
+        url = url.replace('&amp;', '&').rstrip('.,;:)')
+        # Относительные ссылки преобразуем в полные
+        if url.startswith('//'):
+            url = 'https:' + url
+        elif url.startswith('/'):
+            url = 'https://kemono.cr' + url
+        
+        if url in seen_links:
+            return
+        # Фильтруем ТОЛЬКО настоящие облачные ссылки, kemono разрешаем всегда
+        is_cloud = CLOUD_DOMAIN_RE.search(url) or (source == 'html' and PATREON_MEDIA_RE.search(url))
+        if is_cloud and not KEMONO_DOMAIN_RE.search(url):
+            return
+        seen_links.add(url)
+        links.append(ContentLink(url, source))
+    
+    for token in CONTENT_TOKEN_RE.finditer(content):
+        tag, attrs, text_url = token.groups()
+        if text_url:
+            for url in iter_text_file_links(text_url):
+                add(url, 'text')
+            continue
+        
+        for attr_match in CONTENT_ATTR_RE.finditer(attrs):
+            attr, value = attr_match.groups()
+            if value and is_media_attribute(tag, attr, value, attrs):
+                add(value, 'html')
+        
+        # Ссылки в атрибутах считаются и как текст (например data-url="https://...png")
+        if 'http' in attrs:
+            for url in iter_text_file_links(attrs):
+                add(url, 'text')
+    
+    return links
+
+def get_content_link_urls(links):
+    """Ссылки из списка ContentLink (с итогом поиска в лог)"""
+    html_count = sum(1 for link in links if link.source == 'html')
+    print(f"  🔍 find_media_links_in_content: найдено {len(links)} ссылок "
+          f"(HTML теги: {html_count}, текст: {len(links) - html_count})")
+    return [link.url for link in links]
+
 def find_media_links_in_content(content):
-    """Находит ссылки на медиа файлы в тексте контента (ИСПРАВЛЕНО: убрана избыточная фильтрация)"""
+    """Находит ссылки на медиа файлы в тексте контента (см. extract_content_links)"""
+    return get_content_link_urls(extract_content_links(content))
+
+# HTML fallback строит дерево только из ссылок и видео (с их <source>), остальная страница пропускается
+HTML_MEDIA_STRAINER = SoupStrainer(['a', 'video'])
+
+def extract_html_media(content):
+    """
+    Находит файлы на HTML странице поста (content - сырые bytes или str).
+    Возвращает (media_links, cloud_links)
+    """
+    soup = BeautifulSoup(content, HTML_PARSER, parse_only=HTML_MEDIA_STRAINER)
+    
+    # Один обход тегов: ссылки для скачивания, видео и остальные ссылки на файлы
+    # собираются отдельно, чтобы сохранить порядок (сначала вложения, потом видео)
+    download_links, video_links, file_links = [], [], []
+    for tag in soup.find_all(['a', 'video']):
+        if tag.name == 'video':
+            for source in tag.find_all('source'):
+                src = source.get('src', '')
+                if src:
+                    video_links.append((src, src.split('/')[-1].split('?')[0]))
+            continue
+        
+        href = tag.get('href', '')
+        if not href:
+            continue
+        
+        # 1. Ссылки для скачивания (post__attachment-link)
+        if 'post__attachment-link' in (tag.get('class') or []):
+            download_links.append((href, tag.get('download', '')))
+        
+        # 3. Все ссылки на файлы с расширениями (универсальный поиск)
+        filename = href.split('/')[-1].split('?')[0]
+        if '.' in filename and is_supported_file(filename):
+            if href.startswith('/'):
+                href = f"https://kemono.cr{href}"
+            elif not href.startswith('http'):
+                continue
+            file_links.append((href, filename))
+    
     media_links = []
+    seen_links = set()  # Быстрая проверка дубликатов
     
-    # 1. Парсим HTML теги <a href="..."> и <figure> (РАСШИРЕННЫЕ паттерны для kemono)
-    html_patterns = [
-        # fileThumb image-link href="..."
-        r'<a[^>]*class="[^"]*fileThumb[^"]*image-link[^"]*"[^>]*href="([^"]+)"',
-        # Любые img src="..." с kemono доменами
-        r'<img[^>]*src="([^"]*(?:kemono\.cr|kemono\.party)[^"]*)"',
-        # Относительные ссылки img src="/..." (kemono файлы) - РАСШИРЕННЫЙ паттерн
-        r'<img[^>]*src="(/[^"]*\.(?:png|jpg|jpeg|gif|webp|svg|bmp|tiff|tga|psd|mp4|avi|mkv|mov|webm)[^"]*)"',
-        # Любые a href="..." с медиа файлами - РАСШИРЕННЫЙ паттерн
-        r'<a[^>]*href="([^"]*(?:\.mp4|\.avi|\.mkv|\.mov|\.webm|\.zip|\.rar|\.7z|\.jpg|\.png|\.gif|\.jpeg|\.webp|\.bmp)[^"]*)"',
-        # Любые ссылки на data/ папки kemono
-        r'<[^>]*(?:href|src)="([^"]*(?:kemono\.cr|kemono\.party)[^"]*/data/[^"]*)"',
-        # Относительные ссылки на data/ папки - БОЛЕЕ ШИРОКИЙ паттерн
-        r'<[^>]*(?:href|src)="(/data/[^"]*)"',
-        # НОВЫЙ: Относительные ссылки на любые kemono папки
-        r'<[^>]*(?:href|src)="(/[0-9a-f]{2}/[0-9a-f]{2}/[^"]*\.(?:png|jpg|jpeg|gif|webp|svg|bmp|mp4|avi|mkv|mov)[^"]*)"',
-        # НОВЫЙ: Любые kemono CDN ссылки (n1, n2, n3, n4, n5, n6...)
-        r'<[^>]*(?:href|src)="(https://n[0-9]+\.kemono\.cr/[^"]*)"',
-    ]
+    for href, filename in download_links:
+        media_links.append(href)
+        seen_links.add(href)
+        print(f"    📎 HTML скачивание: {filename}")
     
-    for pattern in html_patterns:
-        matches = re.findall(pattern, content, re.IGNORECASE | re.DOTALL)
-        for match in matches:
-            # Очищаем от HTML entities и лишних символов
-            match = match.replace('&amp;', '&').rstrip('.,;:)')
-            
-            # Преобразуем относительные ссылки в полные
-            if match.startswith('/'):
-                match = 'https://kemono.cr' + match
-            elif match.startswith('//'):
-                match = 'https:' + match
-            
-            # БОЛЕЕ ТОЧНАЯ фильтрация: проверяем только НАСТОЯЩИЕ облачные домены
-            # НЕ включаем kemono.cr в фильтрацию!
-            cloud_domains = ['drive.google.com', 'mega.nz', 'mega.co.nz', 'dropbox.com', 
-                            'onedrive.live.com', '1drv.ms', 'mediafire.com', 'we.tl', 
-                            'wetransfer.com', 'pcloud.com', 'disk.yandex.', 'box.com', 
-                            'icloud.com', 'patreon.com/media-u']
-            
-            # Фильтруем ТОЛЬКО настоящие облачные ссылки
-            is_cloud = any(domain in match.lower() for domain in cloud_domains)
-            
-            # ВСЕГДА разрешаем kemono.cr ссылки
-            is_kemono = 'kemono.cr' in match.lower() or 'kemono.party' in match.lower()
-            
-            if (not is_cloud or is_kemono) and match not in media_links:
-                media_links.append(match)
-                print(f"      📸 HTML тег: {match.split('/')[-1][:50]}...")
-    
-    # 2. Паттерны для поиска файлов в тексте (ИСКЛЮЧАЯ облачные хранилища)
-    # Более строгая фильтрация облачных доменов (БЕЗ kemono.cr!)
-    strict_cloud_domains = ['drive.google.com', 'mega.nz', 'mega.co.nz', 'dropbox.com', 
-                           'onedrive.live.com', '1drv.ms', 'mediafire.com', 'we.tl', 
-                           'wetransfer.com', 'pcloud.com', 'disk.yandex.', 'box.com', 'icloud.com']
-    
-    url_patterns = [
-        # Все поддерживаемые расширения
-        r'https?://[^\s<>"]+\.(?:glb|gltf|blend|fbx|obj|dae|3ds|max|ma|mb)',  # 3D модели
-        r'https?://[^\s<>"]+\.(?:mp4|avi|mkv|mov|webm|flv|wmv|m4v|mpg|mpeg)',  # Видео
-        r'https?://[^\s<>"]+\.(?:png|jpg|jpeg|gif|bmp|tiff|tga|psd|webp|svg)',  # Изображения
-        r'https?://[^\s<>"]+\.(?:zip|rar|7z|tar|gz|bz2|xz)',  # Архивы
-        r'https?://[^\s<>"]+\.(?:pdf|doc|docx|txt|rtf)',  # Документы
-        r'https?://[^\s<>"]+\.(?:mp3|wav|flac|ogg|m4a|aac)',  # Аудио
-        r'https?://[^\s<>"]+\.(?:unity|unitypackage|prefab|asset)',  # Unity
-        r'https?://[^\s<>"]+\.(?:dds|hdr|exr|mat)',  # Текстуры
-        r'https?://[^\s<>"]+\.(?:exe|msi|dmg|apk|ipa)',  # Приложения
-        # Kemono данные (ВСЕГДА включаем kemono.cr ссылки)
-        r'https?://[^\s<>"]*(?:kemono\.cr|kemono\.party)[^\s<>"]*/data/[^\s<>"]*',
-        # НОВЫЙ: n1.kemono.cr, n2.kemono.cr и т.д.
-        r'https?://n[0-9]+\.kemono\.cr/[^\s<>"]*',
-    ]
+    # 2. Видео теги
+    for src, filename in video_links:
+        if src not in seen_links:
+            media_links.append(src)
+            seen_links.add(src)
+            print(f"    🎬 HTML видео: {filename}")
     
-    for pattern in url_patterns:
-        matches = re.findall(pattern, content, re.IGNORECASE)
-        for match in matches:
-            # Очищаем от лишних символов в конце
-            match = match.rstrip('.,;:)')
-            
-            # ВАЖНО: Проверяем, что это НЕ облачная ссылка, НО разрешаем kemono.cr
-            is_cloud = any(domain in match.lower() for domain in strict_cloud_domains)
-            is_kemono = 'kemono.cr' in match.lower() or 'kemono.party' in match.lower()
-            
-            # Включаем ссылку если это НЕ облако ИЛИ это kemono
-            if (not is_cloud or is_kemono) and match not in media_links:
-                media_links.append(match)
-                print(f"      🔗 Текст ссылка: {match.split('/')[-1][:50]}...")
+    for href, filename in file_links:
+        if href not in seen_links:
+            media_links.append(href)
+            seen_links.add(href)
+            print(f"    🔗 HTML файл ({get_file_type(filename)}): {filename}")
     
-    print(f"  🔍 find_media_links_in_content: найдено {len(media_links)} ссылок (включая kemono)")
-    return media_links
+    # Облачные ссылки ищем один раз по исходному HTML (и в тегах, и в тексте)
+    return media_links, detect_cloud_links(content)
 
 def get_post_media_from_html_fallback(post_url):
     """Резервный метод получения медиа из HTML страницы"""
     print(f"  🌐 Пробуем HTML парсинг: {post_url}")
     
     try:
-        session = requests.Session()
-        session.headers.update({
-            'User-Agent': STATIC_USER_AGENT,
-            'Referer': 'https://kemono.cr/',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-        })
+        response = http_get(post_url, headers=HTML_HEADERS, verify=False, timeout=30)
         
-        response = session.get(post_url, verify=False, timeout=30)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()  # Сбой сервера - пост остается необработанным
         
         if response.status_code != 200:
             print(f"  ❌ HTML ошибка: {response.status_code}")
             return []
         
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        media_links = []
-        
-        # 1. Ищем ссылки для скачивания (post__attachment-link)
-        download_links = soup.find_all('a', class_='post__attachment-link')
-        for link in download_links:
-            href = link.get('href', '')
-            filename = link.get('download', '')
-            if href:
-                media_links.append(href)
-                print(f"    📎 HTML скачивание: {filename}")
-        
-        # 2. Ищем видео теги
-        video_tags = soup.find_all('video')
-        for video in video_tags:
-            sources = video.find_all('source')
-            for source in sources:
-                src = source.get('src', '')
-                if src and src not in media_links:
-                    media_links.append(src)
-                    filename = src.split('/')[-1].split('?')[0]
-                    print(f"    🎬 HTML видео: {filename}")
-        
-        # 3. Ищем ВСЕ ссылки на файлы (универсальный поиск)
-        all_links = soup.find_all('a', href=True)
-        for link in all_links:
-            href = link['href']
-            filename = href.split('/')[-1].split('?')[0]
-            
-            # Проверяем все файлы с расширениями
-            if '.' in filename and is_supported_file(filename):
-                if href.startswith('/'):
-                    href = f"https://kemono.cr{href}"
-                elif not href.startswith('http'):
-                    continue
-                
-                if href not in media_links:
-                    media_links.append(href)
-                    file_type = get_file_type(filename)
-                    print(f"    🔗 HTML файл ({file_type}): {filename}")
-        
-        # Ищем облачные ссылки в HTML контенте
-        page_content = soup.get_text()
-        cloud_links = detect_cloud_links(str(soup) + page_content)
+        media_links, cloud_links = run_parser(extract_html_media, response.content)
         
         if cloud_links:
             print(f"  ☁️ HTML парсинг нашел облачных ссылок: {len(cloud_links)}")
@@ -1169,7 +2160,10 @@ def get_post_media_from_html_fallback(post_url):
             print(f"  ❌ HTML парсинг не нашел медиа")
         
         return media_links
-        
+    
+    except requests.RequestException as e:
+        print(f"  ❌ HTML страница недоступна, пост остается необработанным: {e}")
+        raise
     except Exception as e:
         print(f"  ❌ Ошибка HTML парсинга: {e}")
         return []
@@ -1178,50 +2172,125 @@ def get_post_media_from_html_fallback(post_url):
 # КОНСОЛЬНЫЙ ИНТЕРФЕЙС
 # =====================================
 
-def download_post_media(post_url, save_dir, progress_data=None):
-    """Скачивает медиа из одного поста с поддержкой резюме"""
+# Сколько постов одновременно запрашиваем у API при поиске файлов.
+# Это отдельный пул от потоков скачивания, а частоту запросов к API
+# ограничивает своя категория "api" в rate_limiter
+DISCOVERY_WORKERS = 4
+
+def get_discovery_workers():
+    """
+    Сколько постов ищем одновременно: DISCOVERY_WORKERS, а с пулом разбора -
+    не меньше числа его процессов (каждый поток ждет свой разбор, иначе
+    одновременно разбиралось бы не больше DISCOVERY_WORKERS постов)
+    """
+    return max(DISCOVERY_WORKERS, _parse_processes if _parse_pool else 0)
+
+def fetch_posts_media(post_urls, save_dir=None, listing_by_url=None,
+                      workers=None, stop_check=None):
+    """
+    Ищет файлы в постах параллельно, не больше workers запросов сразу
+    (по умолчанию get_discovery_workers()).
+    Отдает (индекс, post_url, media_links, ошибка) строго в порядке постов.
+    listing_by_url - записи листинга для быстрого поиска (см. get_post_media_from_listing)
+    """
+    listing_by_url = listing_by_url or {}
+    workers = workers or get_discovery_workers()
+    
+    def fetch(post_url):
+        if post_url in listing_by_url:
+            return get_post_media_from_listing(listing_by_url[post_url], enhanced_search=True, save_dir=save_dir)
+        return get_post_media(post_url, enhanced_search=True, save_dir=save_dir)
+    
+    # Запрашиваем вперед не больше двух постов на поток - результаты
+    # все равно отдаются по порядку, а память не растет
+    window = max(workers, 1) * 2
+    posts = iter(enumerate(post_urls))
+    pending = deque()
+    
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        try:
+            while True:
+                while len(pending) < window:
+                    next_post = next(posts, None)
+                    if next_post is None:
+                        break
+                    index, post_url = next_post
+                    pending.append((index, post_url, executor.submit(fetch, post_url)))
+                
+                if not pending or (stop_check and stop_check()):
+                    return
+                
+                index, post_url, future = pending.popleft()
+                try:
+                    yield index, post_url, future.result(), None
+                except Exception as e:
+                    yield index, post_url, None, e
+        finally:
+            # Остановка или выход из цикла - не ждем еще не начатые запросы
+            for _, _, future in pending:
+                future.cancel()
+
+def download_post_media(post_url, save_dir, progress_data=None, media_links=None, version=None):
+    """
+    Скачивает медиа из одного поста с поддержкой резюме.
+    media_links - уже найденные ссылки (быстрый поиск по листингу), иначе запрос к API поста
+    version - edited/published из листинга: обработанный пост другой версии обрабатывается заново
+    """
     try:
         # Создаем ID поста для отслеживания
         post_id = hashlib.md5(post_url.encode()).hexdigest()
         
-        # Проверяем, был ли этот пост уже обработан
-        if progress_data and post_id in progress_data.get('completed_posts', []):
+        # Проверяем, был ли этот пост уже обработан (и не изменился ли он с тех пор)
+        if progress_data and not select_pending_posts([post_url], progress_data, {post_url: version})[0]:
             print(f"📄 Пост уже обработан ранее: {post_url}")
             return True
         
         print(f"📄 Обрабатываем пост: {post_url}")
         
-        # Получаем медиа файлы из поста
-        media_links = get_post_media(post_url, enhanced_search=True, save_dir=save_dir)
+        # Получаем медиа файлы из поста (если не найдены заранее)
+        if media_links is None:
+            media_links = get_post_media(post_url, enhanced_search=True, save_dir=save_dir)
         
         # Облачные файлы уже обработаны в get_post_media
         
         if not media_links:
+            # Текстовый пост тоже обработан (как в GUI), иначе автор с таким постом
+            # никогда не будет пройден целиком (mark_full_listing).
+            # Недоступный API сюда не попадает - get_post_media выбрасывает ошибку
             print(f"  ⚠️ Медиа не найдено в посте")
-            return False
+            if progress_data:
+                record_post_completed(save_dir, progress_data, post_id, version)
+            return True
         
         print(f"  📁 Найдено файлов: {len(media_links)}")
         
+        # Уже скачанные файлы (например у измененного поста) не трогаем
+        new_links = filter_new_media(media_links, progress_data)
+        if len(new_links) < len(media_links):
+            print(f"  ⏭️ Уже скачано ранее: {len(media_links) - len(new_links)}, новых: {len(new_links)}")
+        
         # Многопоточное скачивание
-        success_count = download_files_parallel(media_links, save_dir, progress_data, max_workers=3)
+        success_count = download_files_parallel(new_links, save_dir, progress_data, max_workers=3) if new_links else 0
         
         # Отмечаем пост как завершенный
         if progress_data:
-            if 'completed_posts' not in progress_data:
-                progress_data['completed_posts'] = []
-            
-            progress_data['completed_posts'].append(post_id)
-            save_download_progress(save_dir, progress_data)
+            record_post_completed(save_dir, progress_data, post_id, version)
         
-        print(f"  ✅ Пост завершен: {success_count}/{total_count} файлов")
-        return success_count > 0
+        print(f"  ✅ Пост завершен: {success_count}/{len(new_links)} файлов")
+        return success_count > 0 or not new_links
         
     except Exception as e:
         print(f"  ❌ Ошибка обработки поста: {e}")
         return False
 
-def download_creator_posts(creator_url, save_dir, post_limit=None):
-    """Скачивает все посты автора с поддержкой резюме"""
+def download_creator_posts(creator_url, save_dir, post_limit=None, fast_discovery=False,
+                           full_rescan=False):
+    """
+    Скачивает все посты автора с поддержкой резюме.
+    fast_discovery - строить список файлов по листингу автора, запрашивая
+    отдельный пост только когда нужен Enhanced поиск по контенту
+    full_rescan - всегда загружать листинг целиком, без инкрементальной остановки
+    """
     try:
         print("🚀 Начинаем скачивание автора с поддержкой резюме...")
         
@@ -1238,9 +2307,16 @@ def download_creator_posts(creator_url, save_dir, post_limit=None):
             print(f"   Уже обработано постов: {completed_posts}")
             print(f"   Уже скачано файлов: {completed_files}")
         
-        # Получаем все посты автора
+        # Получаем все посты автора (или только новые, если автор уже был пройден целиком)
         print("🔍 Получаем список постов...")
-        all_posts = get_creator_posts(creator_url)
+        known_posts = get_incremental_known_posts(progress_data, full_rescan)
+        if known_posts:
+            print("🔁 Инкрементальная синхронизация: листинг до уже обработанных постов")
+        listing_status = {}
+        posts_data = get_creator_posts_data(creator_url, known_posts=known_posts, status=listing_status,
+                                            known_versions=progress_data.get('post_versions'))
+        all_posts = [post['post_url'] for post in posts_data]
+        listing_by_url = {post['post_url']: post for post in posts_data} if fast_discovery else {}
         
         if not all_posts:
             print("❌ Посты не найдены!")
@@ -1254,35 +2330,47 @@ def download_creator_posts(creator_url, save_dir, post_limit=None):
             posts = all_posts
             print(f"🎯 Обрабатываем ВСЕ {len(posts)} постов")
         
-        # Фильтруем уже обработанные посты
-        completed_post_ids = progress_data.get('completed_posts', [])
-        pending_posts = []
+        # Фильтруем уже обработанные посты (кроме измененных с прошлого раза)
+        post_versions = {post['post_url']: get_post_version(post) for post in posts_data}
+        pending_posts, changed_posts = select_pending_posts(posts, progress_data, post_versions)
+        if changed_posts:
+            print(f"✏️ Изменено с прошлого раза: {changed_posts} постов - докачаем новые вложения")
         
-        for post_url in posts:
-            post_id = hashlib.md5(post_url.encode()).hexdigest()
-            if post_id not in completed_post_ids:
-                pending_posts.append(post_url)
+        # Снимок прогресса в начале прохода (started_at, исходные версии постов),
+        # дальше изменения только дописываются в журнал
+        save_download_progress(save_dir, progress_data)
+        
+        # Автор пройден целиком - следующие запуски могут синхронизироваться инкрементально.
+        # Инкрементальный листинг до конца списка не доходит и полным не считается,
+        # иначе периодический полный проход (правки старых постов) никогда бы не наступил
+        full_listing = not known_posts and listing_status.get('reached_end') and not post_limit
         
         if not pending_posts:
             print("✅ Все посты уже обработаны!")
+            if full_listing:
+                mark_full_listing(save_dir, progress_data, posts)
             return True
         
         print(f"📋 К обработке: {len(pending_posts)} постов (из {len(posts)} общих)")
         
         total_downloaded = 0
         
-        for i, post_url in enumerate(pending_posts):
+        # Посты запрашиваются параллельно, но обрабатываются по порядку
+        for i, post_url, media_links, error in fetch_posts_media(pending_posts, save_dir, listing_by_url):
             print(f"\n📄 [{i+1}/{len(pending_posts)}] Обрабатываем пост...")
             
-            if download_post_media(post_url, save_dir, progress_data):
+            if error:
+                print(f"  ❌ Ошибка получения поста {i+1}: {error}")
+                continue
+            
+            if download_post_media(post_url, save_dir, progress_data, media_links=media_links,
+                                   version=post_versions.get(post_url)):
                 print(f"  ✅ Пост {i+1} завершен")
             else:
                 print(f"  ⚠️ Пост {i+1} пропущен")
-            
-            # Минимальная пауза между постами
-            if i < len(pending_posts) - 1:
-                import time
-                time.sleep(0.1)
+        
+        if full_listing:
+            mark_full_listing(save_dir, progress_data, posts)
         
         # Финальная статистика
         final_completed_posts = len(progress_data.get('completed_posts', []))
@@ -1476,4 +2564,6 @@ def console_interface():
                 break
 
 if __name__ == "__main__":
+    # В собранном exe дочерние процессы пула разбора не должны запускать интерфейс заново
+    multiprocessing.freeze_support()
     console_interface()
\ No newline at end of file
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🦊 KemonoDownloader - Blob Store
+================================
+Необязательное хранилище файлов по хешу содержимого. Пути CDN kemono -
+это SHA-256 файла (/data/ce/15/ce152b1d...png), поэтому один и тот же файл
+у разных постов и авторов хранится один раз в .kemono_blobs, а в папках
+авторов лежат жесткие ссылки на него (или копии, если ссылки не поддерживаются).
+Наличие блоба на диске и есть общий индекс: повторно файл не скачивается.
+"""
+
+import os
+import re
+import shutil
+import hashlib
+import threading
+from kemono_network import DATA_PATH_RE
+
+# Папка хранилища в корне папки загрузок
+BLOB_DIR_NAME = '.kemono_blobs'
+
+# Имя файла на CDN: SHA-256 содержимого + расширение
+HASH_NAME_RE = re.compile(r'^([0-9a-fA-F]{64})(\.[A-Za-z0-9]{1,10})?$')
+
+
+def hash_file(digest, path, limit=None, chunk_size=1024 * 1024):
+    """Добавляет в digest содержимое файла (или первые limit байт)"""
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest
+
+
+def file_sha256(path):
+    """SHA-256 файла на диске (потоково)"""
+    return hash_file(hashlib.sha256(), path).hexdigest()
+
+
+def hashed_filepath(filepath, sha256):
+    """Имя для другого файла с тем же именем: начало хеша перед расширением (1_ce152b1d.png)"""
+    stem, ext = os.path.splitext(filepath)
+    return f"{stem}_{sha256[:8]}{ext}"
+
+
+def url_sha256(url):
+    """SHA-256 файла из его пути на CDN или None, если хеш в URL неизвестен"""
+    key = BlobStore.key_for(url)
+    return BlobStore.key_hash(key) if key else None
+
+
+class BlobStore:
+    """Файлы по хешу содержимого: root/ce/15/ce152b1d...png"""
+    
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+    
+    @staticmethod
+    def key_for(url):
+        """Ключ блоба по URL CDN (хеш.расширение) или None для других ссылок"""
+        match = DATA_PATH_RE.match(url or '')
+        if not match:
+            return None
+        name = match.group(2).rsplit('/', 1)[-1]
+        if not HASH_NAME_RE.match(name):
+            return None
+        return name.lower()
+    
+    @staticmethod
+    def key_hash(key):
+        return key.split('.', 1)[0]
+    
+    def blob_path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+    
+    def has(self, key):
+        return os.path.exists(self.blob_path(key))
+    
+    def _is_blob_copy(self, key, path):
+        """Файл - это блоб (жесткая ссылка) или его точная копия"""
+        blob = self.blob_path(key)
+        if os.path.exists(blob):
+            if os.path.samefile(blob, path):
+                return True
+            if os.path.getsize(blob) != os.path.getsize(path):
+                return False
+        return file_sha256(path) == self.key_hash(key)
+    
+    def resolve_target(self, filepath, key):
+        """
+        Путь для файла в папке автора. Если там уже лежит другой файл с тем же
+        именем, к имени добавляется начало хеша вместо перезаписи
+        """
+        if not os.path.exists(filepath) or self._is_blob_copy(key, filepath):
+            return filepath
+        return hashed_filepath(filepath, self.key_hash(key))
+    
+    def _place(self, source, target):
+        """Жесткая ссылка source -> target (копия, если ссылки не поддерживаются)"""
+        temp = f"{target}.{threading.get_ident()}.link"  # Свой временный файл у каждого потока
+        if os.path.exists(temp):
+            os.remove(temp)
+        try:
+            os.link(source, temp)
+        except OSError:
+            shutil.copy2(source, temp)
+        os.replace(temp, target)
+    
+    def link(self, key, filepath):
+        """Кладет блоб в папку автора по пути filepath"""
+        blob = self.blob_path(key)
+        if os.path.exists(filepath) and os.path.samefile(blob, filepath):
+            return
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        self._place(blob, filepath)
+    
+    def adopt(self, filepath, key):
+        """
+        Добавляет скачанный файл в хранилище. Если блоб уже есть (скачан
+        параллельно другим потоком) - файл заменяется ссылкой на него
+        """
+        if self.has(key):
+            self.link(key, filepath)
+            return
+        blob = self.blob_path(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        self._place(filepath, blob)
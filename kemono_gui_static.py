@@ -20,7 +20,8 @@ import sys
 import os
 import time
 import threading
-import json
+import queue
+import multiprocessing
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QLabel, QLineEdit, QPushButton, QTextEdit, 
                            QProgressBar, QSpinBox, QDoubleSpinBox, QCheckBox,
@@ -30,12 +31,20 @@ from PyQt6.QtGui import QFont, QIcon
 
 # Импорт нашего улучшенного движка без fake-useragent (с автопоиском доменов)
 sys.path.append(os.path.dirname(__file__))
-from downloader_static import (get_creator_posts, get_post_media, download_file, 
+from downloader_static import (get_creator_posts_data,
+                              download_file, 
                               load_download_progress, save_download_progress, 
                               download_creator_posts, show_download_status,
                               detect_cloud_links, download_cloud_files,
-                              download_files_parallel)
-import requests
+                              download_files_parallel, HEADERS, SEGMENTED_CONNECTIONS,
+                              ADAPTIVE_MIN_WORKERS, PIPELINE_QUEUE_SIZE, iter_media_queue,
+                              fetch_posts_media, get_incremental_known_posts, mark_full_listing,
+                              get_post_version, select_pending_posts, record_post_completed,
+                              filter_new_media, set_progress_database, set_blob_store,
+                              set_parse_processes, PARSE_PROCESSES)
+from kemono_network import http_get, set_bandwidth_limit
+from kemono_state import ProgressDatabase, PROGRESS_DB_NAME
+from kemono_blobs import BLOB_DIR_NAME
 import urllib3
 import hashlib
 from datetime import datetime
@@ -79,18 +88,8 @@ class DownloaderWorker(QThread):
     def get_creator_info(self, service, creator_id):
         """Получает информацию автора через API"""
         try:
-            session = requests.Session()
-            session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Referer': 'https://kemono.cr/',
-                'Accept': 'text/css',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept-Encoding': 'gzip, deflate',
-                'Connection': 'keep-alive'
-            })
-            
             url = f"https://kemono.cr/api/v1/{service}/user/{creator_id}"
-            response = session.get(url, verify=False, timeout=30)
+            response = http_get(url, headers=HEADERS, verify=False, timeout=30)
             
             if response.status_code == 200:
                 data = response.json()
@@ -118,6 +117,99 @@ class DownloaderWorker(QThread):
             'id': creator_id
         }
     
+    def put_media(self, media_queue, url):
+        """Кладет ссылку в очередь скачивания, ожидая место; False - если скачивание остановлено"""
+        while self.running:
+            try:
+                media_queue.put(url, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def discover_media(self, pending_posts, listing_by_url, save_dir, progress_data, media_queue):
+        """Поток поиска: разбирает посты по очереди и сразу отдает найденные ссылки на скачивание"""
+        try:
+            # Посты запрашиваются параллельно (get_discovery_workers), результаты приходят по порядку
+            posts_media = fetch_posts_media(pending_posts, save_dir, listing_by_url,
+                                            stop_check=lambda: not self.running)
+            for i, post_url, media_links, error in posts_media:
+                if not self.running:
+                    break
+                
+                self.progress.emit(i, len(pending_posts))
+                self.log.emit(f"📄 [{i + 1}/{len(pending_posts)}] Анализируем пост...")
+                
+                try:
+                    if error:
+                        raise error
+                    
+                    post_id = hashlib.md5(post_url.encode()).hexdigest()
+                    
+                    if media_links:
+                        self.log.emit(f"   📎 Найдено {len(media_links)} файлов")
+                        # Уже скачанные файлы (например у измененного поста) не трогаем
+                        new_links = filter_new_media(media_links, progress_data)
+                        if len(new_links) < len(media_links):
+                            self.log.emit(f"   ⏭️ Уже скачано ранее: {len(media_links) - len(new_links)}, новых: {len(new_links)}")
+                    else:
+                        new_links = []
+                        self.log.emit(f"   ⚠️ Медиа не найдено")  # Пост все равно отмечается как обработанный
+                    
+                    self.post_ids[post_id] = post_url
+                    for url in self.register_post(post_id, new_links, save_dir, progress_data):
+                        if not self.put_media(media_queue, url):
+                            posts_media.close()
+                            return
+                        
+                except Exception as e:
+                    self.log.emit(f"❌ Ошибка поста {i + 1}: {e}")
+        finally:
+            # Маркер конца: потоки скачивания доделают очередь и завершатся
+            self.put_media(media_queue, None)
+    
+    def register_post(self, post_id, media_links, save_dir, progress_data):
+        """
+        Запоминает, какие файлы ждет пост. Пост без файлов сразу отмечается обработанным.
+        Возвращает ссылки, которых еще нет в очереди скачивания
+        """
+        new_links = []
+        with self.pipeline_lock:
+            waiting = 0
+            for url in dict.fromkeys(media_links):
+                if url in self.finished_links:
+                    continue  # Уже скачан для другого поста
+                waiting += 1
+                if url not in self.link_posts:
+                    self.link_posts[url] = []
+                    new_links.append(url)
+                self.link_posts[url].append(post_id)
+            
+            self.found_files += len(new_links)
+            if waiting:
+                self.post_files_left[post_id] = waiting
+            else:
+                self.mark_posts_completed([post_id], save_dir, progress_data)
+        return new_links
+    
+    def file_finished(self, url, save_dir, progress_data):
+        """Файл обработан - посты, у которых не осталось файлов, отмечаются завершенными"""
+        with self.pipeline_lock:
+            self.finished_links.add(url)
+            done_posts = []
+            for post_id in self.link_posts.pop(url, []):
+                self.post_files_left[post_id] -= 1
+                if self.post_files_left[post_id] == 0:
+                    del self.post_files_left[post_id]
+                    done_posts.append(post_id)
+            if done_posts:
+                self.mark_posts_completed(done_posts, save_dir, progress_data)
+    
+    def mark_posts_completed(self, post_ids, save_dir, progress_data):
+        for post_id in post_ids:
+            version = self.post_versions.get(self.post_ids.get(post_id))
+            record_post_completed(save_dir, progress_data, post_id, version)
+    
     def run(self):
         try:
             self.log.emit("🚀 Начинаем скачивание...")
@@ -156,9 +248,21 @@ class DownloaderWorker(QThread):
                 self.log.emit(f"   Уже обработано постов: {completed_posts}")
                 self.log.emit(f"   Уже скачано файлов: {completed_files}")
             
-            # Получаем все посты автора
+            # Получаем все посты автора (или только новые, если автор уже был пройден целиком)
             self.log.emit("🔍 Получаем список постов...")
-            all_posts = get_creator_posts(self.creator_url)
+            known_posts = get_incremental_known_posts(progress_data, self.settings.get('full_rescan', False))
+            if known_posts:
+                self.log.emit("🔁 Инкрементальная синхронизация: листинг до уже обработанных постов")
+            listing_status = {}
+            posts_data = get_creator_posts_data(self.creator_url, known_posts=known_posts, status=listing_status,
+                                                known_versions=progress_data.get('post_versions'))
+            all_posts = [post['post_url'] for post in posts_data]
+            
+            # Быстрый поиск: файлы берем прямо из листинга автора
+            fast_discovery = self.settings.get('fast_discovery', False)
+            listing_by_url = {post['post_url']: post for post in posts_data} if fast_discovery else {}
+            if fast_discovery:
+                self.log.emit("⚡ Быстрый поиск: файлы из листинга, API поста только для Enhanced поиска")
             
             if not all_posts:
                 self.log.emit("❌ Посты не найдены!")
@@ -173,124 +277,115 @@ class DownloaderWorker(QThread):
                 posts = all_posts
                 self.log.emit(f"🎯 Обрабатываем ВСЕ {len(posts)} постов")
             
-            # Фильтруем уже обработанные посты
-            completed_post_ids = progress_data.get('completed_posts', [])
-            pending_posts = []
+            # Фильтруем уже обработанные посты (кроме измененных с прошлого раза)
+            self.post_versions = {post['post_url']: get_post_version(post) for post in posts_data}
+            pending_posts, changed_posts = select_pending_posts(posts, progress_data, self.post_versions)
+            if changed_posts:
+                self.log.emit(f"✏️ Изменено с прошлого раза: {changed_posts} постов - докачаем новые вложения")
             
-            for post_url in posts:
-                post_id = hashlib.md5(post_url.encode()).hexdigest()
-                if post_id not in completed_post_ids:
-                    pending_posts.append(post_url)
+            # Снимок прогресса в начале прохода (started_at, исходные версии постов),
+            # дальше изменения только дописываются в журнал
+            save_download_progress(save_dir, progress_data)
+            
+            # Автор пройден целиком - следующие запуски могут синхронизироваться инкрементально
+            # (инкрементальный листинг до конца списка не доходит и полным не считается)
+            full_listing = (not known_posts and listing_status.get('reached_end')
+                            and not self.settings['post_limit'])
             
             if not pending_posts:
                 self.log.emit("✅ Все посты уже обработаны!")
+                if full_listing:
+                    mark_full_listing(save_dir, progress_data, posts)
                 completed_files = len(progress_data.get('completed_files', {}))
                 self.finished.emit(completed_files)
                 return
             
             self.log.emit(f"📋 К обработке: {len(pending_posts)} новых постов (из {len(posts)} общих)")
             
-            # НОВАЯ ЛОГИКА: Сначала собираем ВСЕ файлы, потом скачиваем массово
             total_downloaded = len(progress_data.get('completed_files', {}))  # Уже скачанные файлы
             
-            self.log.emit(f"🔍 Шаг 1: Собираем файлы из {len(pending_posts)} постов...")
+            # Поиск файлов и скачивание идут одновременно: поток поиска кладет ссылки
+            # в ограниченную очередь, потоки скачивания забирают их сразу
+            max_workers = self.settings.get('threads_count', 5)
+            if self.settings.get('adaptive_threads', False):
+                self.log.emit(f"🚀 Ищем файлы в {len(pending_posts)} постах и сразу качаем в {ADAPTIVE_MIN_WORKERS}-{max_workers} потоков (авто)!")
+            else:
+                self.log.emit(f"🚀 Ищем файлы в {len(pending_posts)} постах и сразу качаем в {max_workers} потоков!")
             
-            # Собираем все файлы из всех постов
-            all_media_links = []
-            processed_posts = []
+            media_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+            self.pipeline_lock = threading.Lock()
+            self.post_files_left = {}  # post_id -> сколько файлов поста еще не скачано
+            self.link_posts = {}  # url -> посты, которые ждут этот файл
+            self.finished_links = set()
+            self.found_files = 0
+            self.post_ids = {}  # post_id -> post_url (для версии поста при завершении)
             
-            for i, post_url in enumerate(pending_posts):
-                if not self.running:
-                    break
-                    
-                self.progress.emit(i, len(pending_posts))
-                self.log.emit(f"📄 [{i + 1}/{len(pending_posts)}] Анализируем пост...")
-                    
-                try:
-                    post_id = hashlib.md5(post_url.encode()).hexdigest()
-                    
-                    # Получаем файлы из поста
-                    media_links = get_post_media(post_url, enhanced_search=True, save_dir=save_dir)
-                    
-                    if media_links:
-                        self.log.emit(f"   📎 Найдено {len(media_links)} файлов")
-                        all_media_links.extend(media_links)
-                        processed_posts.append(post_id)
-                    else:
-                        self.log.emit(f"   ⚠️ Медиа не найдено")
-                        processed_posts.append(post_id)  # Все равно отмечаем как обработанный
-                        
-                except Exception as e:
-                    self.log.emit(f"❌ Ошибка поста {i + 1}: {e}")
+            discovery = threading.Thread(
+                target=self.discover_media,
+                args=(pending_posts, listing_by_url, save_dir, progress_data, media_queue),
+                daemon=True
+            )
+            discovery.start()
             
-            # Проверяем, есть ли файлы для скачивания
-            if not all_media_links:
-                self.log.emit("⚠️ Не найдено файлов для скачивания")
-                # Отмечаем все посты как завершенные
-                if 'completed_posts' not in progress_data:
-                    progress_data['completed_posts'] = []
-                progress_data['completed_posts'].extend(processed_posts)
-                save_download_progress(save_dir, progress_data)
-            else:
-                # Получаем количество потоков из настроек
-                max_workers = self.settings.get('threads_count', 5)
-                self.log.emit(f"🚀 Шаг 2: Многопоточное скачивание {len(all_media_links)} файлов в {max_workers} потоков!")
-                
-                # МАССОВОЕ многопоточное скачивание ВСЕХ файлов
-                downloaded_count = download_files_parallel(
-                    all_media_links, 
-                    save_dir, 
-                    progress_data, 
-                    max_workers=max_workers,
-                    thread_callback=self.thread_progress.emit,
-                    overall_callback=self.overall_progress.emit,
-                    stop_check=lambda: not self.running
-                )
-                
-                total_downloaded += downloaded_count
-                
-                # Отмечаем все посты как завершенные
-                if 'completed_posts' not in progress_data:
-                    progress_data['completed_posts'] = []
-                progress_data['completed_posts'].extend(processed_posts)
-                save_download_progress(save_dir, progress_data)
-                
+            downloaded_count = download_files_parallel(
+                iter_media_queue(media_queue, stop_check=lambda: not self.running),
+                save_dir, 
+                progress_data, 
+                max_workers=max_workers,
+                thread_callback=self.thread_progress.emit,
+                overall_callback=self.overall_progress.emit,
+                stop_check=lambda: not self.running,
+                segments=SEGMENTED_CONNECTIONS if self.settings.get('segmented') else 1,
+                adaptive=self.settings.get('adaptive_threads', False),
+                file_callback=lambda url, success: self.file_finished(url, save_dir, progress_data)
+            )
+            
+            if self.running:
+                discovery.join()
+                if full_listing:
+                    mark_full_listing(save_dir, progress_data, posts)
+            
+            total_downloaded += downloaded_count
+            
+            if self.found_files:
                 self.log.emit(f"✅ Массовое скачивание завершено: {downloaded_count} файлов")
-                
-                # НОВОЕ: Скачиваем облачные файлы после обычных (если включено)
-                if self.running and self.settings.get('download_cloud', True):
-                    self.log.emit("🌐 Шаг 3: Проверяем облачные файлы...")
-                    cloud_links_file = os.path.join(save_dir, "cloud_links.txt")
-                    if os.path.exists(cloud_links_file):
-                        try:
-                            # Читаем облачные ссылки из файла
-                            with open(cloud_links_file, 'r', encoding='utf-8') as f:
-                                content = f.read()
+            else:
+                self.log.emit("⚠️ Не найдено файлов для скачивания")
+            
+            # НОВОЕ: Скачиваем облачные файлы после обычных (если включено)
+            if self.running and self.settings.get('download_cloud', True):
+                self.log.emit("🌐 Шаг 2: Проверяем облачные файлы...")
+                cloud_links_file = os.path.join(save_dir, "cloud_links.txt")
+                if os.path.exists(cloud_links_file):
+                    try:
+                        # Читаем облачные ссылки из файла
+                        with open(cloud_links_file, 'r', encoding='utf-8') as f:
+                            content = f.read()
+                        
+                        # Парсим облачные ссылки
+                        from downloader_static import detect_cloud_links
+                        cloud_links = detect_cloud_links(content)
+                        
+                        if cloud_links:
+                            self.log.emit(f"☁️ Найдено {len(cloud_links)} облачных ссылок для скачивания")
                             
-                            # Парсим облачные ссылки
-                            from downloader_static import detect_cloud_links
-                            cloud_links = detect_cloud_links(content)
+                            # Скачиваем облачные файлы
+                            from downloader_static import download_cloud_files
+                            cloud_downloaded = download_cloud_files(save_dir, cloud_links, "batch_download")
                             
-                            if cloud_links:
-                                self.log.emit(f"☁️ Найдено {len(cloud_links)} облачных ссылок для скачивания")
-                                
-                                # Скачиваем облачные файлы
-                                from downloader_static import download_cloud_files
-                                cloud_downloaded = download_cloud_files(save_dir, cloud_links, "batch_download")
-                                
-                                if cloud_downloaded:
-                                    self.log.emit(f"✅ Облачных файлов скачано: {len(cloud_downloaded)}")
-                                    total_downloaded += len(cloud_downloaded)
-                                else:
-                                    self.log.emit("⚠️ Облачные файлы не скачались")
+                            if cloud_downloaded:
+                                self.log.emit(f"✅ Облачных файлов скачано: {len(cloud_downloaded)}")
+                                total_downloaded += len(cloud_downloaded)
                             else:
-                                self.log.emit("ℹ️ Облачных ссылок не найдено")
-                        except Exception as e:
-                            self.log.emit(f"⚠️ Ошибка обработки облачных файлов: {e}")
-                    else:
-                        self.log.emit("ℹ️ Файл cloud_links.txt не найден")
-                elif self.running:
-                    self.log.emit("⚙️ Скачивание облачных файлов отключено в настройках")
+                                self.log.emit("⚠️ Облачные файлы не скачались")
+                        else:
+                            self.log.emit("ℹ️ Облачных ссылок не найдено")
+                    except Exception as e:
+                        self.log.emit(f"⚠️ Ошибка обработки облачных файлов: {e}")
+                else:
+                    self.log.emit("ℹ️ Файл cloud_links.txt не найден")
+            elif self.running:
+                self.log.emit("⚙️ Скачивание облачных файлов отключено в настройках")
             
             if self.running:
                 self.log.emit(f"\n🎉 ЗАВЕРШЕНО! Скачано {total_downloaded} файлов")
@@ -314,7 +409,7 @@ class KemonoDownloaderGUI(QMainWindow):
         
     def init_ui(self):
         self.setWindowTitle("KemonoDownloader v2.8.5")
-        self.setGeometry(100, 100, 700, 600)  # Увеличиваем высоту на 20px для нового чекбокса
+        self.setGeometry(100, 100, 700, 780)  # Увеличиваем высоту для новых чекбоксов
         
         # Центральный виджет
         central_widget = QWidget()
@@ -375,13 +470,38 @@ class KemonoDownloaderGUI(QMainWindow):
         # Количество потоков
         settings_layout.addWidget(QLabel("Потоки:"), 2, 0)
         self.threads_count_input = QSpinBox()
-        self.threads_count_input.setRange(1, 10)
+        self.threads_count_input.setRange(1, 16)
         self.threads_count_input.setValue(5)
         self.threads_count_input.setFixedHeight(28)
         self.threads_count_input.valueChanged.connect(self.update_thread_bars)
         self.threads_count_input.valueChanged.connect(self.save_settings)
         settings_layout.addWidget(self.threads_count_input, 2, 1)
         
+        # Адаптивное количество потоков (значение спинбокса - верхняя граница)
+        self.adaptive_threads_checkbox = QCheckBox("Авто")
+        self.adaptive_threads_checkbox.setChecked(False)
+        self.adaptive_threads_checkbox.setToolTip(f"Подбирать число потоков автоматически: от {ADAPTIVE_MIN_WORKERS} до значения слева.\nПри ошибках и 429/5xx потоки уменьшаются, при росте скорости - добавляются.")
+        self.adaptive_threads_checkbox.stateChanged.connect(self.save_settings)
+        
+        # Общий лимит скорости на все потоки (меняется на лету, 0 - без лимита)
+        self.speed_limit_input = QDoubleSpinBox()
+        self.speed_limit_input.setRange(0, 1000)
+        self.speed_limit_input.setDecimals(1)
+        self.speed_limit_input.setSingleStep(0.5)
+        self.speed_limit_input.setValue(0)
+        self.speed_limit_input.setSuffix(" МБ/с")
+        self.speed_limit_input.setSpecialValueText("Без лимита")
+        self.speed_limit_input.setFixedHeight(28)
+        self.speed_limit_input.setToolTip("Общий лимит скорости скачивания на все потоки.\nМожно менять во время скачивания.")
+        self.speed_limit_input.valueChanged.connect(set_bandwidth_limit)
+        self.speed_limit_input.valueChanged.connect(self.save_settings)
+        
+        threads_extra_layout = QHBoxLayout()
+        threads_extra_layout.setContentsMargins(0, 0, 0, 0)
+        threads_extra_layout.addWidget(self.adaptive_threads_checkbox)
+        threads_extra_layout.addWidget(self.speed_limit_input)
+        settings_layout.addLayout(threads_extra_layout, 2, 2)
+        
         # Темная тема
         settings_layout.addWidget(QLabel("Тема:"), 3, 0)
         self.dark_theme_checkbox = QCheckBox("Темная")
@@ -397,6 +517,54 @@ class KemonoDownloaderGUI(QMainWindow):
         self.download_cloud_checkbox.stateChanged.connect(self.save_settings)
         settings_layout.addWidget(self.download_cloud_checkbox, 4, 1)
         
+        # Быстрый поиск файлов по листингу автора
+        settings_layout.addWidget(QLabel("Поиск:"), 5, 0)
+        self.fast_discovery_checkbox = QCheckBox("Быстрый")
+        self.fast_discovery_checkbox.setChecked(False)
+        self.fast_discovery_checkbox.setToolTip("Брать файлы из списка постов автора без запроса каждого поста.\nПолный пост запрашивается только для поиска ссылок в тексте.")
+        self.fast_discovery_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.fast_discovery_checkbox, 5, 1)
+        
+        # Сегментированное скачивание больших файлов
+        settings_layout.addWidget(QLabel("Большие:"), 6, 0)
+        self.segmented_checkbox = QCheckBox("Сегментами")
+        self.segmented_checkbox.setChecked(False)
+        self.segmented_checkbox.setToolTip(f"Качать файлы от 64 MB в {SEGMENTED_CONNECTIONS} соединения по частям.\nУскоряет большие видео и архивы при ограничении скорости на соединение.")
+        self.segmented_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.segmented_checkbox, 6, 1)
+        
+        # Полный листинг вместо инкрементальной синхронизации
+        settings_layout.addWidget(QLabel("Список:"), 7, 0)
+        self.full_rescan_checkbox = QCheckBox("Полный")
+        self.full_rescan_checkbox.setChecked(False)
+        self.full_rescan_checkbox.setToolTip("Загружать весь список постов автора.\nИначе после полного прохода листинг останавливается на уже скачанных постах.")
+        self.full_rescan_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.full_rescan_checkbox, 7, 1)
+        
+        # Хранилище прогресса: SQLite база на всю папку загрузок вместо JSON у каждого автора
+        settings_layout.addWidget(QLabel("Прогресс:"), 8, 0)
+        self.sqlite_progress_checkbox = QCheckBox("SQLite")
+        self.sqlite_progress_checkbox.setChecked(False)
+        self.sqlite_progress_checkbox.setToolTip(f"Хранить прогресс в базе {PROGRESS_DB_NAME} в папке загрузок.\nБыстрее на больших библиотеках; прогресс из JSON переносится автоматически.")
+        self.sqlite_progress_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.sqlite_progress_checkbox, 8, 1)
+        
+        # Хранилище файлов по хешу: одинаковые файлы разных постов и авторов хранятся один раз
+        settings_layout.addWidget(QLabel("Дубликаты:"), 9, 0)
+        self.blob_store_checkbox = QCheckBox("По хешу")
+        self.blob_store_checkbox.setChecked(False)
+        self.blob_store_checkbox.setToolTip(f"Хранить файлы CDN один раз в {BLOB_DIR_NAME} в папке загрузок,\nа в папки авторов класть жесткие ссылки. Повторы не скачиваются.")
+        self.blob_store_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.blob_store_checkbox, 9, 1)
+        
+        # Разбор постов в пуле процессов: поиск файлов на всех ядрах, GUI не подтормаживает
+        settings_layout.addWidget(QLabel("Разбор:"), 10, 0)
+        self.parse_processes_checkbox = QCheckBox("В процессах")
+        self.parse_processes_checkbox.setChecked(False)
+        self.parse_processes_checkbox.setToolTip(f"Разбирать JSON и HTML постов в {PARSE_PROCESSES} отдельных процессах.\nУскоряет поиск файлов у больших авторов на многоядерных процессорах.")
+        self.parse_processes_checkbox.stateChanged.connect(self.save_settings)
+        settings_layout.addWidget(self.parse_processes_checkbox, 10, 1)
+        
         layout.addWidget(settings_group)
         
         # Кнопки управления
@@ -551,6 +719,8 @@ class KemonoDownloaderGUI(QMainWindow):
 
     def load_settings(self):
         """Загружает сохраненные настройки"""
+        # Сигналы виджетов вызывают save_settings - не затираем еще не прочитанные значения
+        self._loading_settings = True
         self.download_dir_input.setText(
             self.settings.value("download_dir", os.path.join(os.getcwd(), "downloads"))
         )
@@ -572,13 +742,57 @@ class KemonoDownloaderGUI(QMainWindow):
         download_cloud = self.settings.value("download_cloud", True, type=bool)
         self.download_cloud_checkbox.setChecked(download_cloud)
         
+        # Загружаем настройку быстрого поиска
+        fast_discovery = self.settings.value("fast_discovery", False, type=bool)
+        self.fast_discovery_checkbox.setChecked(fast_discovery)
+        
+        # Загружаем настройку сегментированного скачивания
+        segmented = self.settings.value("segmented", False, type=bool)
+        self.segmented_checkbox.setChecked(segmented)
+        
+        # Загружаем настройку полного листинга
+        full_rescan = self.settings.value("full_rescan", False, type=bool)
+        self.full_rescan_checkbox.setChecked(full_rescan)
+        
+        # Загружаем настройку хранилища прогресса
+        sqlite_progress = self.settings.value("sqlite_progress", False, type=bool)
+        self.sqlite_progress_checkbox.setChecked(sqlite_progress)
+        
+        # Загружаем настройку хранилища по хешу
+        blob_store = self.settings.value("blob_store", False, type=bool)
+        self.blob_store_checkbox.setChecked(blob_store)
+        
+        # Загружаем настройку разбора в процессах
+        parse_processes = self.settings.value("parse_processes", False, type=bool)
+        self.parse_processes_checkbox.setChecked(parse_processes)
+        
+        # Загружаем настройку адаптивных потоков
+        adaptive_threads = self.settings.value("adaptive_threads", False, type=bool)
+        self.adaptive_threads_checkbox.setChecked(adaptive_threads)
+        
+        # Загружаем лимит скорости
+        speed_limit = float(self.settings.value("speed_limit", 0))
+        self.speed_limit_input.setValue(speed_limit)
+        set_bandwidth_limit(speed_limit)
+        self._loading_settings = False
+        
     def save_settings(self):
         """Сохраняет текущие настройки"""
+        if getattr(self, '_loading_settings', False):
+            return
         self.settings.setValue("download_dir", self.download_dir_input.text())
         self.settings.setValue("post_limit", self.post_limit_input.value())
         self.settings.setValue("threads_count", self.threads_count_input.value())
         self.settings.setValue("dark_theme", self.dark_theme_checkbox.isChecked())
         self.settings.setValue("download_cloud", self.download_cloud_checkbox.isChecked())
+        self.settings.setValue("fast_discovery", self.fast_discovery_checkbox.isChecked())
+        self.settings.setValue("segmented", self.segmented_checkbox.isChecked())
+        self.settings.setValue("full_rescan", self.full_rescan_checkbox.isChecked())
+        self.settings.setValue("sqlite_progress", self.sqlite_progress_checkbox.isChecked())
+        self.settings.setValue("blob_store", self.blob_store_checkbox.isChecked())
+        self.settings.setValue("parse_processes", self.parse_processes_checkbox.isChecked())
+        self.settings.setValue("adaptive_threads", self.adaptive_threads_checkbox.isChecked())
+        self.settings.setValue("speed_limit", self.speed_limit_input.value())
     
     def closeEvent(self, event):
         """Обрабатывает закрытие окна"""
@@ -1105,12 +1319,26 @@ class KemonoDownloaderGUI(QMainWindow):
         # Ищем все подпапки с файлами прогресса
         status_info = []
         
-        for root, dirs, files in os.walk(download_dir):
-            if '.kemono_progress.json' in files:
+        # С базой SQLite статус всех авторов - один запрос без обхода папок
+        db_path = os.path.join(download_dir, PROGRESS_DB_NAME)
+        if self.sqlite_progress_checkbox.isChecked() and os.path.exists(db_path):
+            for creator in ProgressDatabase(db_path).status():
+                started_at = creator['started_at'] or 'Неизвестно'
+                status_info.append({
+                    'path': creator['path'],
+                    'posts': creator['posts'],
+                    'files': creator['files'],
+                    'size_mb': creator['size'] / (1024 * 1024),
+                    'started': started_at[:19] if started_at != 'Неизвестно' else started_at
+                })
+        
+        for root, dirs, files in ([] if status_info else os.walk(download_dir)):
+            if BLOB_DIR_NAME in dirs:
+                dirs.remove(BLOB_DIR_NAME)  # Хранилище по хешу - без файлов прогресса
+            if '.kemono_progress.json' in files or '.kemono_progress.jsonl' in files:
                 try:
-                    progress_file = os.path.join(root, '.kemono_progress.json')
-                    with open(progress_file, 'r', encoding='utf-8') as f:
-                        progress_data = json.load(f)
+                    # Снимок + журнал изменений после него
+                    progress_data = load_download_progress(root)
                     
                     relative_path = os.path.relpath(root, download_dir)
                     completed_posts = len(progress_data.get('completed_posts', []))
@@ -1215,12 +1443,31 @@ class KemonoDownloaderGUI(QMainWindow):
         download_dir = self.download_dir_input.text()
         os.makedirs(download_dir, exist_ok=True)
         
+        # Хранилище прогресса: база SQLite в папке загрузок или JSON у каждого автора
+        if self.sqlite_progress_checkbox.isChecked():
+            set_progress_database(os.path.join(download_dir, PROGRESS_DB_NAME))
+        else:
+            set_progress_database(None)
+        
+        # Дедупликация файлов по хешу содержимого
+        if self.blob_store_checkbox.isChecked():
+            set_blob_store(os.path.join(download_dir, BLOB_DIR_NAME))
+        else:
+            set_blob_store(None)
+        
+        # Разбор постов в пуле процессов
+        set_parse_processes(PARSE_PROCESSES if self.parse_processes_checkbox.isChecked() else 0)
+        
         # Настройки
         settings = {
             'download_dir': download_dir,
             'post_limit': self.post_limit_input.value() if self.post_limit_input.value() > 0 else None,
             'threads_count': self.threads_count_input.value(),
-            'download_cloud': self.download_cloud_checkbox.isChecked()
+            'download_cloud': self.download_cloud_checkbox.isChecked(),
+            'fast_discovery': self.fast_discovery_checkbox.isChecked(),
+            'segmented': self.segmented_checkbox.isChecked(),
+            'full_rescan': self.full_rescan_checkbox.isChecked(),
+            'adaptive_threads': self.adaptive_threads_checkbox.isChecked()
         }
         
         # Запускаем рабочий поток
@@ -1353,4 +1600,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # В собранном exe дочерние процессы пула разбора не должны запускать GUI заново
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,935 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🦊 KemonoDownloader - Network Layer
+===================================
+Общий пул HTTP соединений (keep-alive) для API kemono.cr, HTML страниц
+и CDN серверов n1..nN. Используется движком, GUI и облачным загрузчиком.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import ctypes
+import random
+import threading
+import email.utils
+import urllib.parse
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+# Отключаем предупреждения SSL
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Количество хостов, для которых держим отдельные пулы (kemono.cr, img, n1..n6 + запас)
+POOL_HOSTS = 16
+
+# Максимум потоков скачивания (как в настройках GUI) и соединений на один файл
+MAX_DOWNLOAD_THREADS = 16
+MAX_SEGMENTS_PER_FILE = 4
+
+# Размер пула соединений на хост: задается один раз при создании сессии под максимум
+# (+2 соединения на хост для API запросов параллельно со скачиванием).
+# Соединения открываются по требованию, так что большой пул ничего не стоит,
+# а перемонтировать адаптеры живой сессии из разных потоков небезопасно
+POOL_SIZE = MAX_DOWNLOAD_THREADS * MAX_SEGMENTS_PER_FILE + 2
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _mount_adapters(session, pool_size):
+    """Подключает к сессии адаптеры с пулом нужного размера"""
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def get_session():
+    """Возвращает общую сессию с пулом keep-alive соединений (потокобезопасно)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.verify = False
+                _mount_adapters(session, POOL_SIZE)
+                _session = session
+    return _session
+
+
+class NetworkStats:
+    """Счетчики сетевой активности: байты, запросы, ошибки, 429/5xx (потокобезопасно)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_received = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+    
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.bytes_received += nbytes
+    
+    def add_response(self, status):
+        with self._lock:
+            self.requests += 1
+            if status == 429 or status >= 500:
+                self.throttled += 1
+    
+    def add_error(self):
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+    
+    def snapshot(self):
+        """Текущие значения счетчиков (для расчета разницы за интервал)"""
+        with self._lock:
+            return {
+                'time': time.time(),
+                'bytes': self.bytes_received,
+                'requests': self.requests,
+                'errors': self.errors,
+                'throttled': self.throttled,
+            }
+
+
+# Общая статистика всех запросов и скачанных байт
+network_stats = NetworkStats()
+
+
+class BandwidthLimiter:
+    """Общий лимит скорости скачивания в байтах/сек на все потоки (потокобезопасно).
+    
+    Каждый полученный кусок резервирует себе интервал времени nbytes / rate
+    в общей очереди - потоки получают полосу по очереди, поровну на равных кусках.
+    Лимит можно менять на лету, 0 - без ограничения.
+    """
+    
+    BURST_SECONDS = 0.5  # Сколько "неиспользованной" полосы можно накопить
+    
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.next_time = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = max(0, rate)
+            self.next_time = time.monotonic()
+    
+    def consume(self, nbytes):
+        """Ждет, пока nbytes укладываются в общий лимит скорости"""
+        with self._lock:
+            if not self.rate:
+                return  # Без ограничения
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now - self.BURST_SECONDS) + nbytes / self.rate
+            wait = self.next_time - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Общий лимит скорости для всех потоков скачивания
+bandwidth_limiter = BandwidthLimiter()
+
+
+def set_bandwidth_limit(mb_per_second):
+    """Устанавливает общий лимит скорости в МБ/с (0 - без ограничения)"""
+    bandwidth_limiter.set_rate(int(mb_per_second * 1024 * 1024))
+
+
+def count_received(nbytes):
+    """Учитывает байты, полученные в цикле скачивания, и соблюдает общий лимит скорости"""
+    network_stats.add_bytes(nbytes)
+    bandwidth_limiter.consume(nbytes)
+
+
+class TokenBucket:
+    """Token bucket: rate запросов в секунду в среднем, до burst подряд (потокобезопасно)"""
+    
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def configure(self, rate, burst):
+        with self._lock:
+            self.rate = rate
+            self.burst = max(burst, 1)
+            self.tokens = min(self.tokens, self.burst)
+    
+    def pause(self, seconds):
+        """
+        Останавливает выдачу токенов на seconds секунд (например по Retry-After).
+        Паузы от нескольких потоков не складываются - берется самая поздняя
+        """
+        with self._lock:
+            if self.rate:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.paused_until = max(self.paused_until, now + seconds)
+                # После паузы токены копятся заново, без накопленного запаса
+                self.tokens = min(self.tokens, 0)
+                self.updated = self.paused_until
+    
+    def acquire(self):
+        """Ждет, пока не появится токен, и забирает его"""
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return  # Без ограничения
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostRateLimiter:
+    """
+    Ограничитель частоты запросов с отдельным token bucket на каждый хост.
+    Бюджеты задаются по категориям: API kemono, HTML страницы kemono,
+    CDN зеркала nN (у каждого зеркала свой bucket) и прочие хосты (облака).
+    """
+    
+    # Категория: (запросов в секунду, запросов подряд); None - без ограничения
+    DEFAULT_BUDGETS = {
+        'api': (3.0, 6),
+        'html': (2.0, 4),
+        'cdn': (10.0, 20),
+        'other': (5.0, 10),
+    }
+    
+    def __init__(self, budgets=None):
+        self.budgets = dict(self.DEFAULT_BUDGETS)
+        self.budgets.update(budgets or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def classify(url):
+        """Возвращает (категория, ключ bucket) для URL"""
+        parsed = urllib.parse.urlsplit(url)
+        host = (parsed.hostname or '').lower()
+        if re.match(r'^n\d+\.kemono\.', host):
+            return 'cdn', host
+        if host.endswith('kemono.cr') or host.endswith('kemono.su') or host.endswith('kemono.party'):
+            if parsed.path.startswith('/api/'):
+                return 'api', host + '/api'
+            return 'html', host
+        return 'other', host
+    
+    def set_rate(self, category, rate, burst=None):
+        """Меняет бюджет категории (в том числе во время работы)"""
+        burst = burst or max(int((rate or 1) * 2), 1)
+        with self._lock:
+            self.budgets[category] = (rate, burst)
+            for (bucket_category, _), bucket in self._buckets.items():
+                if bucket_category == category:
+                    bucket.configure(rate, burst)
+    
+    def _bucket(self, url):
+        category, key = self.classify(url)
+        with self._lock:
+            bucket = self._buckets.get((category, key))
+            if bucket is None:
+                rate, burst = self.budgets.get(category, (None, 1))
+                bucket = self._buckets[(category, key)] = TokenBucket(rate, burst)
+        return bucket
+    
+    def acquire(self, url):
+        """Ждет разрешения на запрос к хосту URL"""
+        self._bucket(url).acquire()
+    
+    def pause(self, url, seconds):
+        """Приостанавливает все запросы к хосту URL (сервер попросил подождать)"""
+        self._bucket(url).pause(seconds)
+
+
+# Общий ограничитель частоты запросов для всех потоков
+rate_limiter = HostRateLimiter()
+
+
+class CircuitOpenError(requests.RequestException):
+    """Хост временно отключен circuit breaker'ом после серии ошибок"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для одного хоста: после failure_threshold ошибок подряд
+    запросы к хосту не отправляются cooldown секунд, затем пропускается
+    один пробный запрос - успех закрывает breaker, ошибка открывает снова.
+    """
+    
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+    
+    def allow(self):
+        """Можно ли отправить запрос сейчас"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True  # Полуоткрытое состояние - один пробный запрос
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+    
+    def record_failure(self):
+        """Учитывает ошибку. Возвращает True если breaker только что открылся"""
+        with self._lock:
+            self.failures += 1
+            was_open = self.opened_at is not None
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+                return not was_open
+            return False
+
+
+class CircuitBreakers:
+    """Набор circuit breaker'ов: отдельный для API kemono и для каждого хоста/зеркала"""
+    
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._breakers = {}
+        self._lock = threading.Lock()
+    
+    def get(self, url):
+        _, key = HostRateLimiter.classify(url)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.cooldown)
+        return breaker
+    
+    def is_open(self, url):
+        return self.get(url).is_open()
+
+
+# Общие circuit breaker'ы для всех потоков
+circuit_breakers = CircuitBreakers()
+
+
+class RetryPolicy:
+    """
+    Повтор запросов с экспоненциальной задержкой и джиттером.
+    Для 429/503 учитывается заголовок Retry-After.
+    """
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, attempts=4, base_delay=1.0, max_delay=60.0):
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    @staticmethod
+    def retry_after(response):
+        """Значение Retry-After в секундах (число или HTTP дата) или None"""
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+    
+    def delay(self, attempt, response=None):
+        """Пауза перед повтором номер attempt (с 0)"""
+        server_delay = self.retry_after(response)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        backoff = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return backoff * random.uniform(0.5, 1.5)
+
+
+# Политика по умолчанию и без повторов (быстрые проверки зеркал)
+DEFAULT_RETRY = RetryPolicy()
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+def request(method, url, session=None, retry=None, **kwargs):
+    """
+    Выполняет HTTP запрос через общий пул соединений: с учетом лимита частоты
+    хоста, circuit breaker'а хоста и повторами при ошибках сети, 429 и 5xx.
+    """
+    session = session or get_session()
+    retry = retry or DEFAULT_RETRY
+    breaker = circuit_breakers.get(url)
+    
+    for attempt in range(retry.attempts):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Хост временно отключен после серии ошибок: {url[:80]}")
+        
+        rate_limiter.acquire(url)
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            network_stats.add_error()
+            if breaker.record_failure():
+                print(f"🔌 Circuit breaker: хост отключен на {breaker.cooldown:.0f}с ({url[:60]})")
+            if attempt + 1 >= retry.attempts:
+                raise
+            time.sleep(retry.delay(attempt))
+            continue
+        except Exception:
+            # Прочие ошибки (ChunkedEncodingError, TooManyRedirects...) тоже учитываем,
+            # иначе пробный запрос полуоткрытого breaker'а зависнет навсегда
+            network_stats.add_error()
+            if breaker.record_failure():
+                print(f"🔌 Circuit breaker: хост отключен на {breaker.cooldown:.0f}с ({url[:60]})")
+            raise
+        
+        status = response.status_code
+        network_stats.add_response(status)
+        
+        if status not in retry.RETRY_STATUSES:
+            breaker.record_success()
+            return response
+        
+        # 429 - сервер жив, просто просит притормозить; 5xx - считаем сбоем хоста
+        if status == 429:
+            breaker.record_success()
+        elif breaker.record_failure():
+            print(f"🔌 Circuit breaker: хост отключен на {breaker.cooldown:.0f}с ({url[:60]})")
+        
+        if attempt + 1 >= retry.attempts:
+            return response
+        
+        delay = retry.delay(attempt, response)
+        if status == 429:
+            # Притормаживаем все потоки, работающие с этим хостом
+            rate_limiter.pause(url, delay)
+        print(f"    🔁 HTTP {status}, повтор через {delay:.1f}с ({attempt + 1}/{retry.attempts - 1})")
+        response.close()
+        time.sleep(delay)
+    
+    return response
+
+
+def http_get(url, **kwargs):
+    """GET запрос через общий пул соединений"""
+    return request('GET', url, **kwargs)
+
+
+def http_head(url, **kwargs):
+    """HEAD запрос через общий пул соединений"""
+    return request('HEAD', url, **kwargs)
+
+
+# =====================================
+# ДОКАЧКА (HTTP Range) ЧЕРЕЗ .part ФАЙЛЫ
+# =====================================
+
+PART_SUFFIX = '.part'
+
+# Буфер записи .part файлов: крупные write() вместо системного вызова на каждый чанк
+PART_WRITE_BUFFER = 1024 * 1024
+
+
+def get_part_path(filepath):
+    """Путь к временному .part файлу для недокачанного файла"""
+    return filepath + PART_SUFFIX
+
+
+def _part_meta_path(part_path):
+    """Путь к файлу с метаданными докачки (ETag, размер)"""
+    return part_path + '.json'
+
+
+def get_segments_offset(meta):
+    """
+    Сколько байт с начала файла непрерывно скачано при сегментированной загрузке.
+    Сегменты хранятся как [start, end, written] в порядке следования.
+    """
+    offset = 0
+    for start, end, written in meta.get('segments', []):
+        if start != offset:
+            break
+        offset = start + written
+        if written < end - start + 1:
+            break
+    return offset
+
+
+def load_part_state(part_path):
+    """Возвращает (offset, meta) для недокачанного .part файла"""
+    if not os.path.exists(part_path):
+        return 0, {}
+    
+    meta = {}
+    try:
+        with open(_part_meta_path(part_path), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    
+    # Файл после сегментированной загрузки заранее выделен на полный размер -
+    # продолжать можно только с конца непрерывно скачанной части
+    if meta.get('segments'):
+        return get_segments_offset(meta), meta
+    
+    return os.path.getsize(part_path), meta
+
+
+_fallocate = None
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def preallocate(f, offset, length):
+    """
+    Заранее выделяет место под length байт с offset (fallocate на Linux), чтобы
+    файл не фрагментировался при записи. Размер файла не меняется (KEEP_SIZE) -
+    размер .part по-прежнему равен числу скачанных байт и подходит для докачки.
+    На других системах и файловых системах без поддержки ничего не делает.
+    """
+    global _fallocate
+    if length <= 0 or not sys.platform.startswith('linux'):
+        return
+    try:
+        if _fallocate is None:
+            _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+            _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        f.flush()
+        _fallocate(f.fileno(), FALLOC_FL_KEEP_SIZE, offset, length)
+    except (OSError, AttributeError):
+        pass
+
+
+def open_part_file(part_path, mode, offset, total_size=None):
+    """
+    Открывает .part файл для записи: дописывание с offset или запись с нуля.
+    Если известен полный размер, место под оставшуюся часть выделяется сразу
+    """
+    if mode == 'append':
+        f = open(part_path, 'r+b', buffering=PART_WRITE_BUFFER)
+        # Отрезаем заранее выделенный хвост (после сегментов) - размер .part = скачанные байты
+        f.seek(offset)
+        f.truncate()
+    else:
+        f = open(part_path, 'wb', buffering=PART_WRITE_BUFFER)
+        offset = 0
+    if total_size:
+        preallocate(f, offset, total_size - offset)
+    return f
+
+
+class SyncBatcher:
+    """
+    Групповой fsync готовых файлов и их папок: когда набралось max_files
+    файлов, в конце загрузки и при выходе из программы - вместо fsync
+    после каждого файла. Сначала сбрасываются данные файлов, затем папки
+    (переименования .part). Компромисс: при сбое питания до сброса пачки
+    последние файлы могут оказаться неполными - они не проходят проверку
+    размера/SHA-256 в is_file_complete и скачиваются заново.
+    """
+    
+    def __init__(self, max_files=32):
+        self.max_files = max_files
+        self._files = []
+        self._folders = set()
+        self._lock = threading.Lock()
+    
+    def add(self, path):
+        """Добавляет готовый файл в пачку (сбрасывает пачку, если она заполнилась)"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._files.append(path)
+            self._folders.add(os.path.dirname(path))
+            full = len(self._files) >= self.max_files
+        if full:
+            self.flush()
+    
+    def flush(self):
+        """fsync всех файлов пачки, затем их папок (чтобы сохранились переименования)"""
+        with self._lock:
+            files, self._files = self._files, []
+            folders, self._folders = self._folders, set()
+        
+        for path in files:
+            _fsync_path(path)
+        # Папки открываются для fsync только на POSIX (в Windows переименование и так в журнале NTFS)
+        if os.name == 'posix':
+            for folder in folders:
+                _fsync_path(folder, os.O_RDONLY)
+
+
+def _fsync_path(path, flags=os.O_RDWR):
+    """fsync файла (в Windows fsync работает только с открытым на запись файлом)"""
+    try:
+        fd = os.open(path, flags | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+sync_batcher = SyncBatcher()
+atexit.register(sync_batcher.flush)
+
+
+def finish_part(part_path, filepath):
+    """
+    Атомарно переименовывает .part в итоговый файл. Данные и запись в папке
+    сбрасываются на диск пачкой (см. SyncBatcher), а не fsync на каждый файл
+    """
+    os.replace(part_path, filepath)
+    clear_part_state(part_path)
+    sync_batcher.add(filepath)
+
+
+def save_part_state(part_path, meta):
+    """Сохраняет метаданные докачки рядом с .part файлом"""
+    try:
+        with open(_part_meta_path(part_path), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+    except OSError as e:
+        print(f"⚠️ Ошибка сохранения состояния докачки: {e}")
+
+
+def clear_part_state(part_path, remove_part=False):
+    """Удаляет метаданные докачки (и сам .part файл если нужно)"""
+    paths = [_part_meta_path(part_path)]
+    if remove_part:
+        paths.append(part_path)
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def build_resume_headers(headers, offset, meta):
+    """Добавляет к заголовкам Range/If-Range для продолжения с offset байт"""
+    resume_headers = dict(headers or {})
+    if offset > 0:
+        resume_headers['Range'] = f'bytes={offset}-'
+        # Сжатие ломает смещения в байтах - просим файл как есть
+        resume_headers['Accept-Encoding'] = 'identity'
+        validator = meta.get('etag') or meta.get('last_modified')
+        if validator:
+            resume_headers['If-Range'] = validator
+    return resume_headers
+
+
+def parse_content_range(value):
+    """Разбирает 'bytes start-end/total' (или 'bytes */total' у 416) -> (start, end, total)"""
+    match = re.match(r'\s*bytes\s+(?:(\d+)-(\d+)|\*)/(\d+|\*)', value or '')
+    if not match:
+        return None
+    start = int(match.group(1)) if match.group(1) is not None else None
+    end = int(match.group(2)) if match.group(2) is not None else None
+    total = None if match.group(3) == '*' else int(match.group(3))
+    return start, end, total
+
+
+def resolve_resume(response, offset, meta):
+    """
+    Решает, как записывать ответ сервера в .part файл.
+    Возвращает (mode, total_size):
+      'append'   - сервер отдал запрошенный диапазон, дописываем
+      'write'    - сервер проигнорировал Range (200), пишем с нуля
+      'complete' - .part уже содержит весь файл (416)
+      'restart'  - диапазон/ETag не совпали, нужен новый запрос без Range
+      None       - ошибка HTTP
+    """
+    status = response.status_code
+    etag = response.headers.get('ETag')
+    
+    if status == 206 and offset > 0:
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        etag_changed = bool(etag and meta.get('etag') and etag != meta['etag'])
+        if content_range and content_range[0] == offset and not etag_changed:
+            return 'append', content_range[2]
+        return 'restart', None
+    
+    if status == 200:
+        total = response.headers.get('Content-Length')
+        return 'write', int(total) if total and total.isdigit() else None
+    
+    if status == 416 and offset > 0:
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        total = content_range[2] if content_range else meta.get('total')
+        if total and total == offset:
+            return 'complete', total
+        return 'restart', None
+    
+    return None, None
+
+
+def start_part_write(response, part_path, offset, meta):
+    """
+    Проверяет ответ сервера и запоминает ETag/размер для будущей докачки.
+    Возвращает (mode, offset, total_size) - см. resolve_resume().
+    """
+    mode, total = resolve_resume(response, offset, meta)
+    
+    if mode == 'write':
+        offset = 0
+    
+    if mode in ('append', 'write'):
+        # При записи с нуля старые валидаторы больше не относятся к файлу
+        previous = meta if mode == 'append' else {}
+        save_part_state(part_path, {
+            'url': response.url,
+            'etag': response.headers.get('ETag') or previous.get('etag'),
+            'last_modified': response.headers.get('Last-Modified') or previous.get('last_modified'),
+            'total': total,
+        })
+    
+    return mode, offset, total
+
+
+def open_resumable(url, part_path, headers=None, session=None, **kwargs):
+    """
+    Открывает потоковый GET с продолжением недокачанного .part файла.
+    Возвращает (response, mode, offset, total_size) - см. resolve_resume().
+    Если .part больше не подходит, удаляет его и повторяет запрос с нуля.
+    """
+    kwargs.setdefault('stream', True)
+    offset, meta = load_part_state(part_path)
+    
+    response = http_get(url, headers=build_resume_headers(headers, offset, meta), session=session, **kwargs)
+    mode, offset, total = start_part_write(response, part_path, offset, meta)
+    
+    if mode == 'restart':
+        print(f"    ⚠️ Сервер не поддержал докачку, скачиваем заново")
+        response.close()
+        clear_part_state(part_path, remove_part=True)
+        response = http_get(url, headers=dict(headers or {}), session=session, **kwargs)
+        mode, offset, total = start_part_write(response, part_path, 0, {})
+    
+    return response, mode, offset, total
+
+
+# =====================================
+# ВЫБОР CDN ЗЕРКАЛ (n1..nN.kemono.cr)
+# =====================================
+
+def is_server_failure(status):
+    """Ошибка самого сервера (нет ответа, 429, 5xx), а не отсутствие файла"""
+    return status is None or status == 429 or status >= 500
+
+DEFAULT_MIRRORS = ['n1', 'n2', 'n3', 'n4', 'n5', 'n6']
+
+# Файлы kemono лежат по пути /data/ce/15/ce152b1d...; зеркало запоминаем по префиксу /data/ce/15
+DATA_PATH_RE = re.compile(r'^https?://(n\d+)\.kemono\.(?:cr|su|party)(/data/[^?#]*)(\?[^#]*)?')
+
+
+class MirrorManager:
+    """
+    Ранжирует CDN зеркала по измеренному TTFB и скорости и запоминает,
+    какое зеркало отдало файлы с каким префиксом хеша (/data/ce/15).
+    Все методы потокобезопасны - один экземпляр используют все потоки.
+    """
+    
+    # Вес новых измерений в скользящем среднем
+    EWMA_ALPHA = 0.3
+    # Оценка ранга: время получения 1 MB = TTFB + 1 MB / скорость
+    REFERENCE_BYTES = 1024 * 1024
+    # Оценка для зеркал без измерений и штраф за каждую ошибку подряд (секунды)
+    UNKNOWN_SCORE = 1.0
+    FAILURE_PENALTY = 5.0
+    OPEN_CIRCUIT_PENALTY = 1000.0
+    
+    def __init__(self, mirrors=None, domain='kemono.cr', probe_timeout=10):
+        self.mirrors = list(mirrors or DEFAULT_MIRRORS)
+        self.domain = domain
+        self.probe_timeout = probe_timeout
+        self._stats = {mirror: {'ttfb': None, 'speed': None, 'failures': 0} for mirror in self.mirrors}
+        self._prefix_cache = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def split_url(url):
+        """Разбирает URL CDN -> (зеркало, путь /data/..., query) или (None, None, None)"""
+        match = DATA_PATH_RE.match(url or '')
+        if not match:
+            return None, None, None
+        return match.group(1), match.group(2), match.group(3) or ''
+    
+    @staticmethod
+    def prefix_of(data_path):
+        """/data/ce/15/ce152b1d.png -> /data/ce/15"""
+        return '/'.join(data_path.split('/')[:4])
+    
+    def mirror_url(self, mirror, data_path, query=''):
+        """Собирает URL файла на указанном зеркале"""
+        return f"https://{mirror}.{self.domain}{data_path}{query}"
+    
+    def _ewma(self, old, new):
+        return new if old is None else old + self.EWMA_ALPHA * (new - old)
+    
+    def _score(self, mirror):
+        stats = self._stats.get(mirror)
+        if not stats:
+            return self.UNKNOWN_SCORE
+        score = self.UNKNOWN_SCORE if stats['ttfb'] is None else stats['ttfb']
+        if stats['speed']:
+            score += self.REFERENCE_BYTES / stats['speed']
+        # Зеркала с открытым circuit breaker'ом - в самый конец
+        if circuit_breakers.is_open(f"https://{mirror}.{self.domain}/"):
+            score += self.OPEN_CIRCUIT_PENALTY
+        return score + stats['failures'] * self.FAILURE_PENALTY
+    
+    def record_success(self, mirror, ttfb=None, nbytes=0, seconds=0, data_path=None):
+        """Учитывает удачный запрос к зеркалу (TTFB, скорость) и запоминает префикс"""
+        with self._lock:
+            stats = self._stats.setdefault(mirror, {'ttfb': None, 'speed': None, 'failures': 0})
+            stats['failures'] = 0
+            if ttfb is not None:
+                stats['ttfb'] = self._ewma(stats['ttfb'], ttfb)
+            # Скорость считаем только на заметных объемах - маленькие файлы ее не отражают
+            if nbytes >= 256 * 1024 and seconds > 0:
+                stats['speed'] = self._ewma(stats['speed'], nbytes / seconds)
+            if data_path:
+                self._prefix_cache[self.prefix_of(data_path)] = mirror
+    
+    def record_failure(self, mirror, data_path=None, penalize=True):
+        """
+        Учитывает ошибку зеркала и забывает его для префикса.
+        penalize=False - файла просто нет на зеркале (404), само зеркало исправно
+        """
+        with self._lock:
+            stats = self._stats.setdefault(mirror, {'ttfb': None, 'speed': None, 'failures': 0})
+            if penalize:
+                stats['failures'] += 1
+            if data_path and self._prefix_cache.get(self.prefix_of(data_path)) == mirror:
+                del self._prefix_cache[self.prefix_of(data_path)]
+    
+    def observe(self, url, ok, ttfb=None, nbytes=0, seconds=0, status=None):
+        """Учитывает результат запроса по полному URL (если это CDN зеркало)"""
+        mirror, data_path, _ = self.split_url(url)
+        if not mirror:
+            return
+        if ok:
+            self.record_success(mirror, ttfb, nbytes, seconds, data_path)
+        else:
+            self.record_failure(mirror, data_path, penalize=is_server_failure(status))
+    
+    def export_state(self):
+        """Статистика зеркал и выученные префиксы (для сохранения между запусками)"""
+        with self._lock:
+            return {
+                'stats': {mirror: dict(stats) for mirror, stats in self._stats.items()},
+                'prefixes': dict(self._prefix_cache),
+            }
+    
+    def import_state(self, state):
+        """Восстанавливает сохраненную статистику; ошибки подряд не переносятся"""
+        with self._lock:
+            for mirror, stats in state.get('stats', {}).items():
+                self._stats[mirror] = {'ttfb': stats.get('ttfb'), 'speed': stats.get('speed'), 'failures': 0}
+            self._prefix_cache.update(state.get('prefixes', {}))
+    
+    def ranked(self):
+        """Зеркала от лучшего к худшему"""
+        with self._lock:
+            return sorted(self.mirrors, key=self._score)
+    
+    def candidates(self, data_path, preferred=None):
+        """
+        Порядок зеркал для нового запроса: зеркало, уже отдававшее этот префикс,
+        затем указанное в URL (если оно не хуже среднего), затем остальные по рангу
+        """
+        with self._lock:
+            learned = self._prefix_cache.get(self.prefix_of(data_path))
+        
+        order = []
+        if learned:
+            order.append(learned)
+        ranked = self.ranked()
+        if preferred and preferred in self.mirrors and ranked.index(preferred) < max(len(ranked) // 2, 1):
+            order.append(preferred)
+        order.extend(ranked)
+        if preferred and preferred not in order:
+            order.append(preferred)
+        return list(dict.fromkeys(order))
+    
+    def _probe_one(self, mirror, data_path, headers):
+        url = self.mirror_url(mirror, data_path)
+        started = time.time()
+        try:
+            # Без повторов - медленное или мертвое зеркало просто уходит в конец списка
+            response = http_head(url, headers=headers, verify=False, timeout=self.probe_timeout, retry=NO_RETRY)
+            response.close()
+            return mirror, response.status_code, time.time() - started
+        except Exception:
+            return mirror, None, None
+    
+    def probe(self, data_path, headers=None, exclude=()):
+        """
+        Параллельно проверяет HEAD запросом все зеркала для файла.
+        Возвращает зеркала, на которых файл есть, от быстрого к медленному.
+        """
+        mirrors = [mirror for mirror in self.mirrors if mirror not in exclude
+                   and not circuit_breakers.is_open(self.mirror_url(mirror, '/'))]
+        if not mirrors:
+            return []
+        
+        with ThreadPoolExecutor(max_workers=len(mirrors)) as executor:
+            results = list(executor.map(lambda mirror: self._probe_one(mirror, data_path, headers), mirrors))
+        
+        available = []
+        for mirror, status, ttfb in results:
+            if status == 200:
+                with self._lock:
+                    stats = self._stats.setdefault(mirror, {'ttfb': None, 'speed': None, 'failures': 0})
+                    stats['failures'] = 0
+                    stats['ttfb'] = self._ewma(stats['ttfb'], ttfb)
+                available.append((ttfb, mirror))
+            else:
+                self.record_failure(mirror, penalize=is_server_failure(status))
+        
+        available.sort()
+        best = [mirror for _, mirror in available]
+        if best:
+            with self._lock:
+                self._prefix_cache[self.prefix_of(data_path)] = best[0]
+        return best
+
+
+# Общий менеджер зеркал для всех потоков скачивания
+mirror_manager = MirrorManager()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🦊 KemonoDownloader - State Store
+=================================
+Необязательное хранилище прогресса в SQLite (WAL) вместо файлов
+.kemono_progress.json в каждой папке автора. Одна база на всю библиотеку:
+посты, файлы, облачные ссылки и статистика зеркал с индексами,
+статус всех авторов - одним запросом без обхода папок.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+# Имя базы в корне папки загрузок
+PROGRESS_DB_NAME = '.kemono_state.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS creators (
+    id INTEGER PRIMARY KEY,
+    save_dir TEXT NOT NULL UNIQUE,
+    started_at TEXT,
+    last_update TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS posts (
+    creator_id INTEGER NOT NULL,
+    post_id TEXT NOT NULL,
+    version TEXT,
+    completed_at TEXT,
+    PRIMARY KEY (creator_id, post_id)
+);
+CREATE TABLE IF NOT EXISTS files (
+    creator_id INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    url TEXT,
+    filepath TEXT,
+    size INTEGER,
+    completed_at TEXT,
+    info TEXT,
+    PRIMARY KEY (creator_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS files_url ON files (url);
+CREATE TABLE IF NOT EXISTS cloud_links (
+    creator_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    service TEXT,
+    post_url TEXT,
+    found_at TEXT,
+    PRIMARY KEY (creator_id, url)
+);
+CREATE TABLE IF NOT EXISTS mirrors (
+    mirror TEXT PRIMARY KEY,
+    ttfb REAL,
+    speed REAL,
+    failures INTEGER
+);
+CREATE TABLE IF NOT EXISTS mirror_prefixes (
+    prefix TEXT PRIMARY KEY,
+    mirror TEXT NOT NULL
+);
+"""
+
+# Поля прогресса, у которых есть свои колонки в creators (остальные - в extra)
+CREATOR_FIELDS = ('started_at', 'last_update')
+# Поля прогресса, которые хранятся в отдельных таблицах
+TABLE_FIELDS = ('completed_posts', 'completed_files', 'post_versions')
+
+
+class ProgressDatabase:
+    """
+    Прогресс загрузок в SQLite. Формат словаря прогресса тот же, что и у JSON
+    (completed_posts, completed_files, post_versions, ...), поэтому движок работает
+    с ним без изменений. Соединение - свое у каждого потока, режим WAL.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = os.path.abspath(db_path)
+        self.root = os.path.dirname(self.db_path)
+        self._local = threading.local()
+        self._creator_ids = {}
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+    
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _key(self, save_dir):
+        """Папка автора относительно базы (библиотеку можно переносить целиком)"""
+        path = os.path.abspath(save_dir)
+        if os.path.commonpath([path, self.root]) == self.root:
+            return os.path.relpath(path, self.root)
+        return path
+    
+    def _creator_id(self, save_dir, create=True):
+        key = self._key(save_dir)
+        with self._lock:
+            if key in self._creator_ids:
+                return self._creator_ids[key]
+        
+        conn = self._connect()
+        row = conn.execute("SELECT id FROM creators WHERE save_dir = ?", (key,)).fetchone()
+        if row is None:
+            if not create:
+                return None
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO creators (save_dir) VALUES (?)", (key,))
+            row = conn.execute("SELECT id FROM creators WHERE save_dir = ?", (key,)).fetchone()
+        
+        with self._lock:
+            self._creator_ids[key] = row[0]
+        return row[0]
+    
+    def has_creator(self, save_dir):
+        return self._creator_id(save_dir, create=False) is not None
+    
+    def load(self, save_dir):
+        """Собирает словарь прогресса автора (None - автора в базе нет)"""
+        creator_id = self._creator_id(save_dir, create=False)
+        if creator_id is None:
+            return None
+        
+        conn = self._connect()
+        started_at, last_update, extra = conn.execute(
+            "SELECT started_at, last_update, extra FROM creators WHERE id = ?", (creator_id,)).fetchone()
+        
+        progress = json.loads(extra) if extra else {}
+        progress['started_at'] = started_at
+        progress['last_update'] = last_update
+        progress['completed_posts'] = []
+        progress['post_versions'] = {}
+        for post_id, version in conn.execute(
+                "SELECT post_id, version FROM posts WHERE creator_id = ? ORDER BY rowid", (creator_id,)):
+            progress['completed_posts'].append(post_id)
+            if version:
+                progress['post_versions'][post_id] = version
+        progress['completed_files'] = {
+            file_id: json.loads(info)
+            for file_id, info in conn.execute(
+                "SELECT file_id, info FROM files WHERE creator_id = ? ORDER BY rowid", (creator_id,))
+        }
+        return progress
+    
+    def save(self, save_dir, progress):
+        """Записывает словарь прогресса автора целиком (одной транзакцией)"""
+        creator_id = self._creator_id(save_dir)
+        extra = {key: value for key, value in progress.items()
+                 if key not in CREATOR_FIELDS and key not in TABLE_FIELDS}
+        versions = progress.get('post_versions', {})
+        
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE creators SET started_at = ?, last_update = ?, extra = ? WHERE id = ?",
+                         (progress.get('started_at'), progress.get('last_update'),
+                          json.dumps(extra, ensure_ascii=False), creator_id))
+            conn.executemany(
+                "INSERT INTO posts (creator_id, post_id, version) VALUES (?, ?, ?) "
+                "ON CONFLICT (creator_id, post_id) DO UPDATE SET version = excluded.version",
+                [(creator_id, post_id, versions.get(post_id)) for post_id in progress.get('completed_posts', [])])
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (creator_id, file_id, url, filepath, size, completed_at, info) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._file_row(creator_id, file_id, info)
+                 for file_id, info in progress.get('completed_files', {}).items()])
+    
+    @staticmethod
+    def _file_row(creator_id, file_id, info):
+        return (creator_id, file_id, info.get('url'), info.get('filepath'), info.get('size'),
+                info.get('completed_at'), json.dumps(info, ensure_ascii=False))
+    
+    def apply(self, save_dir, entry):
+        """Записывает одно изменение прогресса (формат записей журнала)"""
+        creator_id = self._creator_id(save_dir)
+        op = entry.get('op')
+        conn = self._connect()
+        with conn:
+            if op == 'file':
+                conn.execute(
+                    "INSERT OR REPLACE INTO files (creator_id, file_id, url, filepath, size, completed_at, info) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", self._file_row(creator_id, entry['id'], entry['info']))
+            elif op == 'post':
+                conn.execute(
+                    "INSERT INTO posts (creator_id, post_id, version, completed_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (creator_id, post_id) DO UPDATE SET "
+                    "version = COALESCE(excluded.version, version), completed_at = excluded.completed_at",
+                    (creator_id, entry['id'], entry.get('version'), entry.get('at')))
+            elif op == 'set':
+                if entry['key'] in CREATOR_FIELDS:
+                    conn.execute(f"UPDATE creators SET {entry['key']} = ? WHERE id = ?",
+                                 (entry['value'], creator_id))
+                else:
+                    row = conn.execute("SELECT extra FROM creators WHERE id = ?", (creator_id,)).fetchone()
+                    extra = json.loads(row[0]) if row and row[0] else {}
+                    extra[entry['key']] = entry['value']
+                    conn.execute("UPDATE creators SET extra = ? WHERE id = ?",
+                                 (json.dumps(extra, ensure_ascii=False), creator_id))
+            if entry.get('at'):
+                conn.execute("UPDATE creators SET last_update = ? WHERE id = ?", (entry['at'], creator_id))
+    
+    def add_cloud_links(self, save_dir, cloud_links, post_url):
+        """Запоминает облачные ссылки автора (повторы игнорируются)"""
+        creator_id = self._creator_id(save_dir)
+        found_at = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO cloud_links (creator_id, url, service, post_url, found_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(creator_id, link['url'], link.get('service'), post_url, found_at) for link in cloud_links])
+    
+    def save_mirrors(self, state):
+        """Сохраняет статистику зеркал и префиксы (см. MirrorManager.export_state)"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO mirrors (mirror, ttfb, speed, failures) VALUES (?, ?, ?, ?)",
+                [(mirror, stats['ttfb'], stats['speed'], stats['failures'])
+                 for mirror, stats in state['stats'].items()])
+            conn.executemany("INSERT OR REPLACE INTO mirror_prefixes (prefix, mirror) VALUES (?, ?)",
+                             list(state['prefixes'].items()))
+    
+    def load_mirrors(self):
+        conn = self._connect()
+        return {
+            'stats': {mirror: {'ttfb': ttfb, 'speed': speed, 'failures': failures}
+                      for mirror, ttfb, speed, failures in conn.execute(
+                          "SELECT mirror, ttfb, speed, failures FROM mirrors")},
+            'prefixes': dict(conn.execute("SELECT prefix, mirror FROM mirror_prefixes")),
+        }
+    
+    def status(self):
+        """Сводка по всем авторам: папка, постов, файлов, байт, начало загрузки"""
+        conn = self._connect()
+        rows = conn.execute("""
+            SELECT c.save_dir, c.started_at,
+                   (SELECT COUNT(*) FROM posts p WHERE p.creator_id = c.id),
+                   (SELECT COUNT(*) FROM files f WHERE f.creator_id = c.id),
+                   (SELECT COALESCE(SUM(f.size), 0) FROM files f WHERE f.creator_id = c.id)
+            FROM creators c ORDER BY c.save_dir
+        """).fetchall()
+        return [{'path': save_dir, 'started_at': started_at, 'posts': posts, 'files': files, 'size': size}
+                for save_dir, started_at, posts, files, size in rows]